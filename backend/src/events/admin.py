@@ -1,6 +1,15 @@
 from django.contrib import admin
 from .models import Event, Message
 
-admin.site.register(Event)
 
-admin.site.register(Message)
\ No newline at end of file
+@admin.register(Event)
+class EventAdmin(admin.ModelAdmin):
+    list_display = ("event_type", "session_id", "timestamp")
+    # Exact matches, so the lookup uses the session index. There is no event_type list
+    # filter, it would read every distinct type; filter with ?event_type=<type> instead.
+    search_fields = ("=session_id",)
+    ordering = ("-id",)
+    # Counting every row of a large event log is slower than the page itself
+    show_full_result_count = False
+
+admin.site.register(Message)
@@ -2,12 +2,11 @@ from django.apps import AppConfig
 
 
 class EventsConfig(AppConfig):
+    """
+    Event handlers are not started here, so management commands stay fast. They are
+    started for the roles in ``settings.EVENTS_ROLES`` by the ASGI application, and
+    dedicated worker processes run ``manage.py run_worker``.
+    """
+
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'events'
-
-    def ready(self) -> None:
-        """
-        Override app configuration to initialize consumers
-        """
-        from events.subscribers import initialize_listeners
-        initialize_listeners()
\ No newline at end of file
@@ -0,0 +1,194 @@
+from .utils import pcm_to_mono16, resample_pcm16
+
+from collections import deque
+import threading
+import numpy as np
+
+
+class EnergyVAD:
+    """
+    Voice activity detection on the energy of 16-bit PCM frames.
+
+    A frame is speech when its RMS is at least ``min_rms`` and ``ratio`` times the
+    noise floor, a running average of the energy of the frames that were not speech.
+    """
+
+    def __init__(self, min_rms=300, ratio=3.0, adaptation=0.05):
+        self.min_rms = min_rms
+        self.ratio = ratio
+        self.adaptation = adaptation
+        self.noise_floor = 0.0
+
+    def is_speech(self, frame, sample_rate):
+        samples = np.frombuffer(frame, dtype="<i2").astype(np.float32)
+        rms = float(np.sqrt(np.mean(samples * samples))) if len(samples) else 0.0
+
+        speech = rms >= max(self.min_rms, self.noise_floor * self.ratio)
+        if not speech:
+            self.noise_floor += self.adaptation * (rms - self.noise_floor)
+        return speech
+
+
+class WebRtcVAD:
+    """
+    Voice activity detection with the WebRTC VAD (``webrtcvad``), which is far less
+    sensitive to background noise. Frames must be 10, 20 or 30 ms long.
+    """
+
+    def __init__(self, aggressiveness=2):
+        import webrtcvad
+        self.vad = webrtcvad.Vad(aggressiveness)
+
+    def is_speech(self, frame, sample_rate):
+        return self.vad.is_speech(frame, sample_rate)
+
+
+VADS = {
+    "energy": EnergyVAD,
+    "webrtc": WebRtcVAD,
+}
+
+
+class AudioStream:
+    """
+    The audio of one session between chunks.
+
+    Until speech starts, only the last ``pre_roll`` frames are kept in a ring buffer so
+    the first syllable isn't cut off. During speech the frames are collected into the
+    current utterance, which is bounded by the segmenter's maximum length.
+    """
+
+    def __init__(self, vad, pre_roll):
+        self.vad = vad
+        self.remainder = b""
+        self.pre_roll = deque(maxlen=pre_roll)
+        self.utterance = None
+        self.frames = 0
+        self.speech_frames = 0
+        self.silent_frames = 0
+        self.recognition = None
+        self.partial = None
+        self.lock = threading.Lock()
+
+
+class AudioSegmenter:
+    """
+    Cuts streamed audio chunks into utterances with voice activity detection.
+
+    Chunks are converted to 16-bit mono, resampled to ``sample_rate`` and split into
+    ``frame_ms`` frames. An utterance starts after ``start_ms`` of consecutive speech
+    and ends after ``end_ms`` of silence, or when it reaches ``max_seconds``.
+
+    With a streaming speech backend, speech is transcribed while it arrives and
+    ``feed`` reports partial transcriptions, so the final transcription is ready as
+    soon as the utterance ends. Otherwise the audio of the utterance is returned to be
+    transcribed as a whole.
+    """
+
+    def __init__(self, backend=None, vad="energy", vad_options=None, sample_rate=16000, frame_ms=30,
+                 start_ms=90, end_ms=600, pre_roll_ms=300, max_seconds=15):
+        if vad not in VADS:
+            raise ValueError(f"Unknown voice activity detector {vad}")
+
+        self.backend = backend
+        self.vad = vad
+        self.vad_options = vad_options or {}
+        self.sample_rate = sample_rate
+        self.frame_bytes = sample_rate * frame_ms // 1000 * 2
+        self.start_frames = max(1, start_ms // frame_ms)
+        self.end_frames = max(1, end_ms // frame_ms)
+        self.pre_roll_frames = max(self.start_frames, pre_roll_ms // frame_ms)
+        self.max_frames = int(max_seconds * 1000 // frame_ms)
+        self.streams = {}
+        self.lock = threading.Lock()
+
+    def _stream(self, session_id):
+        with self.lock:
+            stream = self.streams.get(session_id)
+            if stream is None:
+                stream = self.streams[session_id] = AudioStream(VADS[self.vad](**self.vad_options), self.pre_roll_frames)
+            return stream
+
+    def _streaming(self):
+        return self.backend is not None and self.backend.supports_streaming
+
+    def _start(self, stream):
+        stream.utterance = bytearray(b"".join(stream.pre_roll))
+        stream.frames = len(stream.pre_roll)
+        stream.silent_frames = 0
+        stream.pre_roll.clear()
+        if self._streaming():
+            stream.recognition = self.backend.stream(self.sample_rate)
+            stream.recognition.accept(stream.utterance)
+
+    def _end(self, stream):
+        utterance, recognition = bytes(stream.utterance), stream.recognition
+        stream.utterance = stream.recognition = stream.partial = None
+        stream.speech_frames = 0
+
+        if recognition is not None:
+            return ("transcription", recognition.finish())
+        return ("utterance", utterance)
+
+    def feed(self, session_id, audio_bytes, sample_rate, sample_width=2, channels=1):
+        """
+        Add a chunk of a session's audio.
+
+        Parameters:
+            session_id (str): The session the audio belongs to.
+            audio_bytes (bytes): Raw little-endian PCM audio.
+            sample_rate (int): The sample rate of the chunk.
+            sample_width (int): The sample width of the chunk in bytes.
+            channels (int): The number of interleaved channels.
+
+        Returns:
+            list: ("partial", text), ("transcription", text) and ("utterance", audio)
+                results, in order. Utterance audio is 16-bit mono at ``sample_rate``.
+        """
+        audio = resample_pcm16(pcm_to_mono16(audio_bytes, sample_width, channels), sample_rate, self.sample_rate)
+        stream = self._stream(session_id)
+        results = []
+
+        with stream.lock:
+            audio = stream.remainder + audio
+            end = len(audio) - len(audio) % self.frame_bytes
+            stream.remainder = audio[end:]
+
+            speech_start = None
+            for offset in range(0, end, self.frame_bytes):
+                frame = audio[offset:offset + self.frame_bytes]
+                speech = stream.vad.is_speech(frame, self.sample_rate)
+
+                if stream.utterance is None:
+                    stream.pre_roll.append(frame)
+                    stream.speech_frames = stream.speech_frames + 1 if speech else 0
+                    if stream.speech_frames >= self.start_frames:
+                        self._start(stream)
+                        speech_start = offset + self.frame_bytes
+                    continue
+
+                stream.utterance += frame
+                stream.frames += 1
+                stream.silent_frames = 0 if speech else stream.silent_frames + 1
+
+                if stream.silent_frames >= self.end_frames or stream.frames >= self.max_frames:
+                    if stream.recognition is not None:
+                        stream.recognition.accept(audio[speech_start or 0:offset + self.frame_bytes])
+                    results.append(self._end(stream))
+                    speech_start = None
+                elif speech_start is None:
+                    speech_start = offset
+
+            # Feed the speech of this chunk to the recognizer at once
+            if stream.recognition is not None and speech_start is not None and speech_start < end:
+                partial = stream.recognition.accept(audio[speech_start:end])
+                if partial and partial != stream.partial:
+                    stream.partial = partial
+                    results.append(("partial", partial))
+
+        return results
+
+    def forget(self, params):
+        """Drop the audio of a session that disconnected, subscribed to session.closed."""
+        with self.lock:
+            self.streams.pop((params.get("metadata") or {}).get("session_id"), None)
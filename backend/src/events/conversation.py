@@ -0,0 +1,104 @@
+from django.conf import settings
+
+from events.models import Message
+
+from collections import OrderedDict, deque
+import threading
+
+
+def estimate_tokens(text):
+    """Rough token count of a chat message, about 4 characters per token plus overhead."""
+    return len(text) // 4 + 4
+
+
+class Conversation:
+    """
+    The recent turns of one conversation, trimmed to a token budget.
+
+    When ``summarize`` is set, turns dropped from the front are kept in ``dropped``
+    until they are folded into the rolling ``summary``.
+    """
+
+    def __init__(self, session_id, token_budget, summarize=False):
+        self.session_id = session_id
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.turns = deque()
+        self.tokens = 0
+        self.summary = None
+        self.dropped = []
+        self.last_timestamp = None
+        self.lock = threading.Lock()
+
+    def append(self, message: Message):
+        self.turns.append((message, estimate_tokens(message.content)))
+        self.tokens += self.turns[-1][1]
+        if message.timestamp and (self.last_timestamp is None or message.timestamp > self.last_timestamp):
+            self.last_timestamp = message.timestamp
+
+        summary_tokens = estimate_tokens(self.summary) if self.summary else 0
+        while self.tokens + summary_tokens > self.token_budget and len(self.turns) > 1:
+            dropped, tokens = self.turns.popleft()
+            self.tokens -= tokens
+            if self.summarize:
+                self.dropped.append(dropped)
+
+    def messages(self):
+        return [message for message, tokens in self.turns]
+
+
+class ConversationCache:
+    """
+    In-process cache of the conversation context of each session.
+
+    A conversation is loaded from the database once, with only its most recent
+    messages, and then updated incrementally: every lookup only fetches the rows newer
+    than the last one seen, an indexed range query on (session_id, timestamp), so
+    messages written by any process are picked up. Each conversation is trimmed to a
+    token budget, and the least recently used conversations are evicted.
+    """
+
+    def __init__(self, token_budget=3000, max_conversations=1000, load_limit=100, summarize=False):
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.max_conversations = max_conversations
+        self.load_limit = load_limit
+        self.conversations = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _messages(self, session_id):
+        return Message.objects.filter(session_id=session_id)
+
+    def get(self, session_id):
+        """The up to date conversation of a session."""
+        with self.lock:
+            conversation = self.conversations.get(session_id)
+            if conversation is None:
+                conversation = self.conversations[session_id] = Conversation(session_id, self.token_budget, self.summarize)
+                while len(self.conversations) > self.max_conversations:
+                    self.conversations.popitem(last=False)
+            else:
+                self.conversations.move_to_end(session_id)
+
+        with conversation.lock:
+            if conversation.last_timestamp is None:
+                messages = reversed(self._messages(session_id).order_by("-timestamp")[:self.load_limit])
+            else:
+                messages = self._messages(session_id).filter(timestamp__gt=conversation.last_timestamp).order_by("timestamp")
+
+            for message in messages:
+                conversation.append(message)
+
+        return conversation
+
+    def forget(self, params):
+        """Drop the conversation of a session that disconnected, subscribed to session.closed."""
+        with self.lock:
+            self.conversations.pop((params.get("metadata") or {}).get("session_id"), None)
+
+
+conversation_cache = ConversationCache(
+    token_budget=settings.LLM_CONTEXT_TOKENS,
+    max_conversations=settings.CONVERSATION_CACHE_SIZE,
+    summarize=settings.LLM_CONTEXT_SUMMARIZE,
+)
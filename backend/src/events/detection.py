@@ -0,0 +1,115 @@
+from .metrics import stage_duration
+from .tracking import FaceTracker
+from .utils import Frame
+
+import cv2
+
+
+class FaceDetector:
+    """
+    Configurable face detector returning (top, right, bottom, left) boxes.
+
+    Models:
+        - hog: dlib HOG detector through face_recognition (default, CPU friendly).
+        - cnn: dlib CNN detector through face_recognition.
+        - mtcnn: facenet-pytorch MTCNN, the detector FER uses with ``mtcnn=True``.
+        - haar: OpenCV Haar cascade on the grayscale frame, the cheapest option.
+
+    Detection time grows with the pixel count, so frames wider than ``max_width`` are
+    downscaled before detection and the boxes are mapped back to frame coordinates.
+    """
+
+    MODELS = ("hog", "cnn", "mtcnn", "haar")
+
+    def __init__(self, model="hog", number_of_times_to_upsample=1, max_width=None):
+        if model not in self.MODELS:
+            raise ValueError(f"Unknown face detection model {model}")
+
+        self.model = model
+        self.number_of_times_to_upsample = number_of_times_to_upsample
+        self.max_width = max_width
+
+        if model == "mtcnn":
+            from facenet_pytorch import MTCNN
+            self.detector = MTCNN(keep_all=True, device="cpu")
+        elif model == "haar":
+            self.detector = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+
+    def detect(self, frame: Frame):
+        """Detect the faces in a frame."""
+        image, factor = frame.resized("gray" if self.model == "haar" else "rgb", self.max_width)
+
+        if self.model in ("hog", "cnn"):
+            import face_recognition
+            boxes = [
+                (left, top, right, bottom)
+                for top, right, bottom, left in face_recognition.face_locations(
+                    image, number_of_times_to_upsample=self.number_of_times_to_upsample, model=self.model
+                )
+            ]
+        elif self.model == "mtcnn":
+            boxes, _ = self.detector.detect(image)
+            boxes = [] if boxes is None else boxes
+        else:
+            boxes = [(x, y, x + w, y + h) for (x, y, w, h) in self.detector.detectMultiScale(image)]
+
+        height, width = frame.bgr.shape[:2]
+        return [
+            (
+                max(0, int(y1 * factor)),
+                min(width, int(x2 * factor)),
+                min(height, int(y2 * factor)),
+                max(0, int(x1 * factor)),
+            )
+            for x1, y1, x2, y2 in boxes
+        ]
+
+
+class FaceDetectionStage:
+    """
+    Face detection shared by the emotion and face recognition services.
+
+    Faces are detected once per frame and cached on the ``Frame``, so every service
+    processing the frame works on the same boxes. With tracking enabled, faces are
+    only detected on keyframes and followed in between by a per-session ``FaceTracker``.
+
+    ``detect`` returns (box, track) pairs, the track is None when tracking is disabled.
+    """
+
+    def __init__(self, detector, tracking=False, tracker_options=None):
+        self.detector = detector
+        self.tracking = tracking
+        self.tracker_options = tracker_options or {}
+        self.trackers = {}
+
+    def _detect(self, frame, session_id):
+        tracker = None
+        if self.tracking and session_id:
+            tracker = self.trackers.get(session_id)
+            if tracker is None:
+                tracker = self.trackers[session_id] = FaceTracker(**self.tracker_options)
+
+            # Between keyframes, follow the known faces instead of detecting them
+            if not tracker.keyframe_due():
+                with stage_duration.time(stage="face_tracking"):
+                    followed = tracker.update(frame.gray)
+                if followed:
+                    return [(track.box, track) for track in tracker.tracks]
+
+        # Decode the frame first, so decoding isn't counted as detection time
+        frame.bgr
+        with stage_duration.time(stage="face_detection"):
+            boxes = self.detector.detect(frame)
+        if tracker is None:
+            return [(box, None) for box in boxes]
+
+        tracker.reset(frame.gray, boxes)
+        return [(track.box, track) for track in tracker.tracks]
+
+    def detect(self, frame: Frame, session_id=None):
+        """Detect (or follow) the faces in a frame, once per frame."""
+        return frame.cached("faces", lambda: self._detect(frame, session_id))
+
+    def forget(self, params):
+        """Drop the tracker of a session that disconnected, subscribed to session.closed."""
+        self.trackers.pop((params.get("metadata") or {}).get("session_id"), None)
@@ -1,64 +1,430 @@
+from channels.layers import get_channel_layer
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
 
+from events.codecs import CodecRegistry
+from events.metrics import (
+    age, event_age, event_latency, events_consumed, events_published, handler_dropped, handler_duration, handler_errors,
+    metrics, pipeline_latency,
+)
+from events.streams import ACK_KEY, StreamTransport
+from events.workers import run_handler
+
 import redis
+import redis.asyncio as aioredis
+import asyncio
 import threading
-import json
+import weakref
+import time
+import uuid
 
 
 class EventBus:
-    def __init__(self):
-        self.redis = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, decode_responses=True)
+    """
+    Redis pub/sub backed event bus.
+
+    Three listener modes are supported, selected with ``settings.EVENT_BUS_MODE``:
+
+    - ``threaded``: one pub/sub connection and daemon thread per channel, handlers run
+      inline on that thread.
+    - ``asyncio``: a single pub/sub connection on a background event loop subscribes to
+      every started channel (or glob pattern) and dispatches handlers concurrently on a
+      thread pool, so a slow handler on one channel never blocks another. Every
+      (channel, handler) has a bounded queue; when it is full the oldest event is
+      dropped, or with ``EVENT_BUS_QUEUE_POLICY = "block"`` the listener waits, leaving
+      the backlog to Redis. The connection is re-established after errors.
+    - ``streams``: like ``asyncio``, but events are queued in Redis Streams and every
+      event is handled by one process only (see ``events.streams.StreamTransport``).
+
+    The subscriber table is copy-on-write: writers swap in a new dict of tuples under
+    ``self.lock``, readers use whatever snapshot they see without locking.
+
+    Messages are encoded once with ``settings.EVENT_BUS_CODEC`` (see ``events.codecs``)
+    and the same bytes are published to the event's channel and to ``event.save`` in
+    one pipelined round trip.
+
+    Code running on an event loop, like the WebSocket consumer, publishes with
+    ``apublish`` and ``aput_blob``, which use asyncio Redis clients and never block it.
+
+    Events listed in ``settings.SESSION_ROUTED_EVENTS`` are also delivered to the
+    WebSocket of their session when published, through the session's Channels group.
+    The group lives in Redis, so this reaches the connection in whichever process
+    holds it, and no process needs to listen for these events.
+    """
+
+    def __init__(self, mode=None):
+        self.redis = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+        self.codecs = CodecRegistry(settings.EVENT_BUS_CODEC)
         self.subscribers = {}
         self.lock = threading.Lock()
+        self.mode = mode or settings.EVENT_BUS_MODE
+        self.session_events = frozenset(settings.SESSION_ROUTED_EVENTS)
+        self.known_events = frozenset(settings.EVENT_TYPES)
+        self.async_clients = weakref.WeakKeyDictionary()
+
+        # Multiplexed (asyncio) listener state
+        self.channels = set()
+        self.ready = threading.Event()
+        self.loop = None
+        self.pubsub = None
+        self.executor = None
+        self.semaphores = {}
+        self.handler_queues = {}
+        self.queue_policy = settings.EVENT_BUS_QUEUE_POLICY
+        self.streams = None
+        self.delivery_loop = None
+        if self.mode == "streams":
+            self.streams = StreamTransport(
+                self,
+                group=settings.EVENT_BUS_STREAM_GROUP,
+                maxlen=settings.EVENT_BUS_STREAM_MAXLEN,
+                batch_size=settings.EVENT_BUS_STREAM_BATCH_SIZE,
+                claim_idle_ms=settings.EVENT_BUS_STREAM_CLAIM_IDLE_MS,
+                prefetch=settings.EVENT_BUS_STREAM_PREFETCH,
+                partitions=settings.EVENT_BUS_STREAM_PARTITIONS,
+                affinity_events=settings.EVENT_BUS_AFFINITY_EVENTS,
+                policies=settings.EVENT_BUS_STREAM_POLICIES,
+            )
+            metrics.gauge("event_bus_stream_inflight", "Stream entries read but not yet acknowledged", lambda: self.streams.inflight)
+        metrics.gauge("event_bus_handler_queue_depth", "Events waiting for a handler", lambda: {
+            (("event", event_name), ("handler", handler_name(handler))): queue.qsize()
+            for (event_name, handler), queue in list(self.handler_queues.items())
+        })
+
+    @staticmethod
+    def session_group(session_id):
+        """Name of the Channels group of a session's WebSocket connection."""
+        return f"session_{session_id}"
+
+    def _session_message(self, event_name, data):
+        """The group and message delivering an event to its session, None when not routed."""
+        session_id = (data.get("metadata") or {}).get("session_id")
+        if event_name not in self.session_events or not session_id:
+            return None
+        return self.session_group(session_id), {"type": "virtual_human.event", "event": data}
+
+    def _channel_loop(self):
+        """
+        The event loop group messages are sent on from handler threads. The channel layer
+        keeps its Redis connections per loop, so it must be a long-lived one.
+        """
+        with self.lock:
+            if self.loop is None and self.delivery_loop is None:
+                self.delivery_loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self.delivery_loop.run_forever, name="event-bus-delivery")
+                thread.daemon = True
+                thread.start()
+            return self.loop or self.delivery_loop
+
+    def _deliver(self, event_name, data):
+        routed = self._session_message(event_name, data)
+        if routed is not None:
+            # Wait for the send, so the events of a session arrive in order
+            send = asyncio.run_coroutine_threadsafe(get_channel_layer().group_send(*routed), self._channel_loop())
+            send.result(timeout=10)
+
+    def metric_label(self, event_name):
+        """
+        The ``event`` label of an event type in metrics. Types come from clients, so
+        unknown ones are counted together instead of adding a label set each.
+        """
+        if event_name in self.known_events or event_name in self.subscribers:
+            return event_name
+        return "other"
+
+    def encode(self, event_name, data):
+        """Encode an event once for both its channel and event.save, which needs the type."""
+        return self.codecs.encode({**data, "type": event_name})
+
+    def _published(self, event_name, data):
+        """
+        Count a published event. Events derived from a client event carry its type and
+        time in ``origin_type`` and ``origin_timestamp`` metadata (handlers pass the
+        metadata on), for them the latency since the client event is observed too.
+        """
+        label = self.metric_label(event_name)
+        events_published.inc(event=label)
+
+        metadata = data.get("metadata") or {}
+        origin = metadata.get("origin_type")
+        if origin and origin != event_name:
+            latency = age(metadata.get("origin_timestamp"))
+            if latency is not None:
+                pipeline_latency.observe(latency, event=label, origin=self.metric_label(origin))
+
+    def _publish(self, pipeline, event_name, message, data):
+        """Add an encoded event to its stream or pub/sub channel on a pipeline."""
+        if self.streams is not None and self.streams.is_queued(event_name):
+            self.streams.add(pipeline, event_name, message, data)
+        else:
+            pipeline.publish(event_name, message)
 
     def publish(self, event_name, data):
         """Publish an event with data."""
         try:
-            self.redis.publish(event_name, json.dumps(data))
+            message = self.encode(event_name, data)
+
+            # Publish to the event's channel and create a save event to log everything
+            pipeline = self.redis.pipeline(transaction=False)
+            self._publish(pipeline, event_name, message, data)
+            self._publish(pipeline, "event.save", message, data)
+            pipeline.execute()
+            self._published(event_name, data)
+
+            self._deliver(event_name, data)
+        except Exception as e:
+            print(f"Failed to publish event {event_name}: {e}")
+
+    def _async_redis(self):
+        """The asyncio Redis client of the running event loop, created once per loop."""
+        loop = asyncio.get_running_loop()
+        client = self.async_clients.get(loop)
+        if client is None:
+            client = self.async_clients[loop] = aioredis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+        return client
+
+    async def apublish(self, event_name, data):
+        """Publish an event with data from a coroutine, without blocking the event loop."""
+        try:
+            message = self.encode(event_name, data)
+
+            pipeline = self._async_redis().pipeline(transaction=False)
+            self._publish(pipeline, event_name, message, data)
+            self._publish(pipeline, "event.save", message, data)
+            await pipeline.execute()
+            self._published(event_name, data)
 
-            # Create save event to log everything
-            self.redis.publish("event.save", json.dumps({
-                **data,
-                "type": event_name,
-            }))
+            routed = self._session_message(event_name, data)
+            if routed is not None:
+                await get_channel_layer().group_send(*routed)
         except Exception as e:
             print(f"Failed to publish event {event_name}: {e}")
 
+    async def aput_blob(self, data, ttl=None):
+        """Asynchronous ``put_blob``."""
+        key = f"blob:{uuid.uuid4().hex}"
+        await self._async_redis().set(key, bytes(data), ex=ttl or settings.EVENT_BUS_BLOB_TTL)
+        return key
+
+    def put_blob(self, data, ttl=None):
+        """
+        Store raw bytes next to the bus and return a key events can carry instead of base64.
+
+        Blobs expire after ``settings.EVENT_BUS_BLOB_TTL`` seconds, so handlers should
+        resolve them shortly after receiving the event.
+        """
+        key = f"blob:{uuid.uuid4().hex}"
+        self.redis.set(key, bytes(data), ex=ttl or settings.EVENT_BUS_BLOB_TTL)
+        return key
+
+    def get_blob(self, key):
+        """Fetch bytes stored with ``put_blob``, or None when expired."""
+        return self.redis.get(key)
+
     def subscribe(self, event_name, handler):
         """Subscribe a handler function to an event."""
         with self.lock:
-            if event_name not in self.subscribers:
-                self.subscribers[event_name] = []
-            self.subscribers[event_name].append(handler)
+            subscribers = dict(self.subscribers)
+            subscribers[event_name] = subscribers.get(event_name, ()) + (handler,)
+            self.subscribers = subscribers
 
-    def _event_listener(self, event_name):
-        """Internal listener for Redis pub/sub."""
-        pubsub = self.redis.pubsub()
-        pubsub.subscribe(event_name)
+    def unsubscribe(self, event_name, handler):
+        """Remove a handler function from an event."""
+        with self.lock:
+            handlers = self.subscribers.get(event_name, ())
+            if handler not in handlers:
+                return
+            subscribers = dict(self.subscribers)
+            subscribers[event_name] = tuple(h for h in handlers if h != handler)
+            self.subscribers = subscribers
 
+    def received(self, event_name, data):
+        """Count an event read from Redis and observe how long it took to get here."""
+        label = self.metric_label(event_name)
+        events_consumed.inc(event=label)
+        age = event_age(data)
+        if age is not None:
+            event_latency.observe(age, event=label)
+
+    def _handle(self, event_name, handler, data):
+        """Run a single handler, reporting (but never propagating) its errors."""
+        name = handler_name(handler)
         try:
-            for message in pubsub.listen():
-                if message["type"] == "message":
-                    try:
-                        data = json.loads(message["data"])
-                        with self.lock:
-                            for handler in self.subscribers.get(event_name, []):
-                                try:
-                                    handler(data)
-                                except Exception as handler_error:
-                                    print(f"Error in handler for {event_name}: {handler_error}")
-                    except json.JSONDecodeError as e:
-                        print(f"Failed to decode message: {e}")
-        except Exception as e:
-            print(f"Listener error for {event_name}: {e}")
-        finally:
-            pubsub.close()
+            with handler_duration.time(event=event_name, handler=name):
+                run_handler(handler, data)
+        except Exception as handler_error:
+            handler_errors.inc(event=event_name, handler=name)
+            print(f"Error in handler for {event_name}: {handler_error}")
 
-    def start_listener(self, event_name):
-        """Start a listener thread for an event."""
-        thread = threading.Thread(target=self._event_listener, args=(event_name,))
+    def _decode(self, message):
+        """Decode a received message, None (after reporting it) when it is malformed."""
+        try:
+            data = self.codecs.decode(message)
+        except ValueError as e:
+            print(f"Failed to decode message: {e}")
+            return None
+        if not isinstance(data, dict):
+            print(f"Dropped message that is not an event: {type(data).__name__}")
+            return None
+        return data
+
+    def _event_listener(self, event_name):
+        """Internal listener for Redis pub/sub, reconnecting after errors."""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                pubsub.subscribe(event_name)
+                for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    data = self._decode(message["data"])
+                    if data is None:
+                        continue
+
+                    self.received(event_name, data)
+                    for handler in self.subscribers.get(event_name, ()):
+                        self._handle(event_name, handler, data)
+            except Exception as e:
+                print(f"Listener error for {event_name}, reconnecting: {e}")
+            finally:
+                pubsub.close()
+            time.sleep(1)
+
+    async def _run_handler(self, event_name, handler, data, ack=None):
+        """
+        Run a handler on the executor, at most N in flight per (channel, handler).
+
+        ``ack`` is the acknowledgement of the stream entry, handed to handlers that
+        defer it (see ``defers_ack``).
+        """
+        if ack is not None and getattr(handler, "defers_ack", False):
+            data = {**data, ACK_KEY: ack.hold()}
+
+        key = (event_name, handler)
+        semaphore = self.semaphores.get(key)
+        if semaphore is None:
+            semaphore = self.semaphores[key] = asyncio.Semaphore(settings.EVENT_BUS_HANDLER_CONCURRENCY)
+
+        async with semaphore:
+            await self.loop.run_in_executor(self.executor, self._handle, event_name, handler, data)
+
+    async def _drain(self, event_name, handler, queue):
+        """Run a handler on the events of its queue, one at a time."""
+        while True:
+            data = await queue.get()
+            await self.loop.run_in_executor(self.executor, self._handle, event_name, handler, data)
+
+    def _handler_queue(self, event_name, handler):
+        """The queue of a (channel, handler), drained by N tasks."""
+        key = (event_name, handler)
+        queue = self.handler_queues.get(key)
+        if queue is None:
+            queue = self.handler_queues[key] = asyncio.Queue(maxsize=settings.EVENT_BUS_HANDLER_QUEUE_SIZE)
+            for _ in range(settings.EVENT_BUS_HANDLER_CONCURRENCY):
+                self.loop.create_task(self._drain(event_name, handler, queue))
+        return queue
+
+    async def _dispatch(self, event_name, data):
+        """Queue a received event for each of its handlers."""
+        for handler in self.subscribers.get(event_name, ()):
+            queue = self._handler_queue(event_name, handler)
+            if self.queue_policy == "block":
+                await queue.put(data)
+                continue
+            if queue.full():
+                queue.get_nowait()
+                handler_dropped.inc(event=event_name, handler=handler_name(handler))
+            queue.put_nowait(data)
+
+    async def _multiplexed_listener(self):
+        """Internal listener multiplexing every channel over one Redis pub/sub connection."""
+        while True:
+            client = aioredis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+            self.pubsub = client.pubsub()
+
+            try:
+                # Subscribe to everything requested so far, again after a reconnect
+                for channel in list(self.channels):
+                    await self._subscribe_channel(channel)
+                self.ready.set()
+
+                while True:
+                    message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is None or message["type"] not in ("message", "pmessage"):
+                        continue
+
+                    event_name = message["channel"].decode()
+                    data = self._decode(message["data"])
+                    if data is None:
+                        continue
+
+                    self.received(event_name, data)
+                    await self._dispatch(event_name, data)
+            except Exception as e:
+                print(f"Multiplexed listener error, reconnecting: {e}")
+            finally:
+                try:
+                    await self.pubsub.aclose()
+                    await client.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(1)
+
+    async def _subscribe_channel(self, channel):
+        """Subscribe the shared pub/sub connection to a channel or glob pattern."""
+        if any(c in channel for c in "*?["):
+            await self.pubsub.psubscribe(channel)
+        else:
+            await self.pubsub.subscribe(channel)
+
+    def _start_loop(self):
+        """Start the background event loop that owns the shared pub/sub connection."""
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.EVENT_BUS_WORKERS, thread_name_prefix="event-bus"
+        )
+        self.loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            if self.streams is not None:
+                self.loop.create_task(self.streams.listen())
+            self.loop.run_until_complete(self._multiplexed_listener())
+
+        thread = threading.Thread(target=run, name="event-bus-listener")
         thread.daemon = True
         thread.start()
 
+    def start_listener(self, event_name):
+        """Start listening for an event."""
+        if self.mode == "threaded":
+            thread = threading.Thread(target=self._event_listener, args=(event_name,))
+            thread.daemon = True
+            thread.start()
+            return
+
+        with self.lock:
+            if event_name in self.channels:
+                return
+            self.channels.add(event_name)
+            started = self.loop is not None
+            if not started:
+                self._start_loop()
+
+            # Queued events are read from their stream instead of a pub/sub channel
+            if self.streams is not None and self.streams.is_queued(event_name):
+                self.channels.discard(event_name)
+                self.streams.events.add(event_name)
+                return
+
+        # Channels added after start-up are subscribed on the running connection
+        if started and self.ready.wait(timeout=5):
+            asyncio.run_coroutine_threadsafe(self._subscribe_channel(event_name), self.loop)
+
+
+def handler_name(handler):
+    """Name of a handler in metrics and logs."""
+    return getattr(handler, "__qualname__", type(handler).__name__)
+
+
 # Singleton instance of the EventBus
 event_bus = EventBus()
@@ -0,0 +1,222 @@
+from django.conf import settings
+from django.db import DatabaseError
+
+from events.models import FaceIdentity
+
+from pathlib import Path
+import numpy as np
+import threading
+import json
+import time
+import os
+
+
+class FaceIndex:
+    """
+    Nearest-neighbour index over enrolled face encodings.
+
+    Encodings persisted as ``FaceIdentity`` rows are loaded once into a contiguous
+    float32 matrix. When a snapshot path is configured the matrix is saved there and
+    memory-mapped on the next start, as long as it still matches the database.
+    Lookups compute the euclidean distance to every enrolled face in one matrix
+    product, newly enrolled faces are appended in place with amortized growth.
+
+    Readers never lock: enrollment fills spare rows first and publishes the new size
+    afterwards, or swaps in a grown copy of the matrix.
+
+    Faces enrolled by other processes are picked up every ``refresh_interval`` seconds
+    by loading the rows added since the last one seen. When loading fails it is retried
+    with an exponential backoff instead of on every lookup.
+    """
+
+    DIMENSIONS = 128
+    MAX_BACKOFF = 60
+
+    def __init__(self, tolerance=0.5, snapshot_path=None, refresh_interval=10):
+        self.tolerance = tolerance
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.last_row = 0
+        self.next_refresh = 0
+        self.backoff = 0
+        self.retry_at = 0
+
+        self.ids = []
+        self.known = set()
+        self.matrix = np.empty((0, self.DIMENSIONS), dtype=np.float32)
+        self.sq_norms = np.empty(0, dtype=np.float32)
+        self.size = 0
+
+    def _load_snapshot(self, count):
+        """Memory-map the snapshot when it holds exactly the enrolled faces in the database."""
+        ids_path = self.snapshot_path.with_suffix(".json")
+        if not self.snapshot_path.exists() or not ids_path.exists():
+            return None
+
+        ids = json.loads(ids_path.read_text())
+        last_row, last_id = FaceIdentity.objects.order_by("-id").values_list("id", "identity_id").first() or (0, None)
+        if len(ids) != count or (ids and ids[-1] != str(last_id)):
+            return None
+        matrix = np.load(self.snapshot_path, mmap_mode="r")
+        if len(matrix) != count:
+            return None
+        return ids, matrix, last_row
+
+    def _replace(self, path, write):
+        """Write a file next to ``path`` and move it in place, so readers never see a partial file."""
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+
+    def _save_snapshot(self, ids, matrix):
+        self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        self._replace(self.snapshot_path, lambda f: np.save(f, matrix))
+        self._replace(self.snapshot_path.with_suffix(".json"), lambda f: f.write(json.dumps(ids).encode()))
+
+    def _failed(self, action, error):
+        """Report a failed database read and back off before the next attempt."""
+        self.backoff = min(self.MAX_BACKOFF, max(1, 2 * self.backoff))
+        self.retry_at = time.monotonic() + self.backoff
+        print(f"Failed to {action} face index, retrying in {self.backoff}s: {error}")
+
+    def load(self):
+        """Load every enrolled face from the database (or its snapshot)."""
+        with self.lock:
+            if self.loaded:
+                return
+
+            try:
+                count = FaceIdentity.objects.count()
+                snapshot = self._load_snapshot(count) if self.snapshot_path else None
+
+                if snapshot is not None:
+                    ids, matrix, last_row = snapshot
+                else:
+                    ids = []
+                    last_row = 0
+                    matrix = np.empty((count, self.DIMENSIONS), dtype=np.float32)
+                    rows = FaceIdentity.objects.order_by("id").values_list("id", "identity_id", "encoding")
+                    for i, (row, identity_id, encoding) in enumerate(rows.iterator(chunk_size=2000)):
+                        if i >= count:
+                            break
+                        ids.append(str(identity_id))
+                        matrix[i] = np.frombuffer(encoding, dtype=np.float32)
+                        last_row = row
+                    matrix = matrix[:len(ids)]
+
+                    if self.snapshot_path:
+                        self._save_snapshot(ids, matrix)
+            except (DatabaseError, OSError, ValueError) as e:
+                self._failed("load", e)
+                return
+
+            self.ids = list(ids)
+            self.known = set(ids)
+            self.matrix = matrix
+            self.sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+            self.size = len(ids)
+            self.last_row = last_row
+            self.next_refresh = time.monotonic() + self.refresh_interval
+            self.backoff = 0
+            self.loaded = True
+
+    def refresh(self):
+        """Add the faces enrolled by other processes since the last load or refresh."""
+        if not self.lock.acquire(blocking=False):
+            # Another thread is already loading or refreshing
+            return
+        try:
+            rows = list(
+                FaceIdentity.objects.filter(id__gt=self.last_row).order_by("id").values_list("id", "identity_id", "encoding")
+            )
+            for row, identity_id, encoding in rows:
+                self._append(str(identity_id), np.frombuffer(encoding, dtype=np.float32))
+                self.last_row = row
+            self.next_refresh = time.monotonic() + self.refresh_interval
+            self.backoff = 0
+        except DatabaseError as e:
+            self._failed("refresh", e)
+            self.next_refresh = self.retry_at
+        finally:
+            self.lock.release()
+
+    def search(self, encodings):
+        """
+        Find the nearest enrolled face for each encoding.
+
+        Returns:
+            list: (identity id or None, distance) per encoding. The identity is None when
+            the nearest face is further away than the tolerance.
+        """
+        now = time.monotonic()
+        if not self.loaded:
+            if now >= self.retry_at:
+                self.load()
+        elif self.refresh_interval and now >= self.next_refresh:
+            self.refresh()
+        if len(encodings) == 0:
+            return []
+
+        size, matrix, sq_norms, ids = self.size, self.matrix, self.sq_norms, self.ids
+        if size == 0:
+            return [(None, None) for _ in encodings]
+
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.DIMENSIONS)
+        sq_distances = (
+            sq_norms[:size][None, :]
+            - 2 * queries @ matrix[:size].T
+            + np.einsum("ij,ij->i", queries, queries)[:, None]
+        )
+        nearest = np.argmin(sq_distances, axis=1)
+        distances = np.sqrt(np.maximum(sq_distances[np.arange(len(queries)), nearest], 0))
+
+        return [
+            (ids[index] if distance <= self.tolerance else None, float(distance))
+            for index, distance in zip(nearest, distances)
+        ]
+
+    def enroll(self, encoding, user=None):
+        """Persist a new face and add it to the index, returns its identity id."""
+        encoding = np.asarray(encoding, dtype=np.float32).reshape(self.DIMENSIONS)
+        identity = FaceIdentity.objects.create(user=user, encoding=encoding.tobytes())
+
+        with self.lock:
+            self._append(str(identity.identity_id), encoding)
+
+        return str(identity.identity_id)
+
+    def _append(self, identity_id, encoding):
+        """
+        Add a face to the matrix, called with the lock held. Faces already indexed are
+        skipped: a refresh may load a face between its enrollment and its ``_append``.
+        """
+        if identity_id in self.known:
+            return
+
+        size = self.size
+        matrix, sq_norms = self.matrix, self.sq_norms
+
+        # Grow into a writable copy when the matrix is full or memory-mapped
+        if size >= len(matrix) or not matrix.flags.writeable:
+            capacity = max(64, 2 * len(matrix))
+            matrix = np.empty((capacity, self.DIMENSIONS), dtype=np.float32)
+            matrix[:size] = self.matrix[:size]
+            sq_norms = np.empty(capacity, dtype=np.float32)
+            sq_norms[:size] = self.sq_norms[:size]
+
+        matrix[size] = encoding
+        sq_norms[size] = encoding @ encoding
+        self.ids.append(identity_id)
+        self.known.add(identity_id)
+        self.matrix, self.sq_norms = matrix, sq_norms
+        self.size = size + 1
+
+
+face_index = FaceIndex(
+    tolerance=settings.FACE_RECOGNITION_TOLERANCE,
+    snapshot_path=settings.FACE_INDEX_SNAPSHOT,
+    refresh_interval=settings.FACE_INDEX_REFRESH_INTERVAL,
+)
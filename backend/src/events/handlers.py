@@ -1,78 +1,178 @@
-from events.models import Event, Message
+from events.models import Message
+from events.conversation import conversation_cache
 from events.event_bus import event_bus
-from events.services import emotion_service, face_recognition_service, llm_service, AudioTranscriptionService
+from events.metrics import stage_duration
+from events.persistence import event_writer
+from events.smoothing import dominant, emotion_smoother
+from events.streams import defers_ack
+from events.services import (
+    audio_segmenter, audio_transcription_service, emotion_service, face_detection, face_recognition_service, llm_service,
+)
+from events.utils import frame_cache, payload_bytes
+from events.workers import process_pool_handler
 
+from django.conf import settings
 from django.utils import timezone
 
-import base64
-
 
 def process_raw_audio(params):
     payload = params.get("payload")
     
-    # Decode the audio from base64
-    wav_data = base64.b64decode(payload.get("bytes"))
+    # Decode the audio from base64 or fetch the raw bytes of a binary message
+    wav_data = payload_bytes(payload, "bytes")
 
-    transcription_service = AudioTranscriptionService()
-    transcription = transcription_service.transcribe_audio(audio_bytes=wav_data, sample_rate=payload.get("sample_rate"), sample_width=payload.get("sample_width"))
+    transcription = audio_transcription_service.transcribe_audio(
+        audio_bytes=wav_data,
+        sample_rate=payload.get("sample_rate") or 44100,
+        sample_width=payload.get("sample_width") or 2,
+        channels=payload.get("channels") or 1,
+    )
     
     if transcription:
-        message = {
-            "type": "audio.transcription",
-            "payload": {
-                "transcription": transcription,
-            },
-            "timestamp": timezone.now().isoformat(),
-            "metadata": None,
-        }
+        publish_transcription(transcription, params.get("metadata"))
 
-        # Publish transcription
-        event_bus.publish(message["type"], message)
 
+def publish_transcription(transcription, metadata, partial=False):
+    message = {
+        "type": "audio.transcription.partial" if partial else "audio.transcription",
+        "payload": {
+            "transcription": transcription,
+        },
+        "timestamp": timezone.now().isoformat(),
+        "metadata": metadata,
+    }
 
-def face_recognition(params):
+    # Publish transcription
+    event_bus.publish(message["type"], message)
+
+
+def process_audio_chunk(params):
+    """
+    Add a chunk of streamed audio to the session's audio stream.
+
+    Transcription starts as soon as voice activity detection finds the end of an
+    utterance: with a streaming speech backend the transcription is already complete
+    and published right away, together with partial transcriptions while the user is
+    speaking. Otherwise the utterance is published as audio.raw for process_raw_audio.
+    """
     payload = params.get("payload")
-    data = payload.get("data")
+    metadata = params.get("metadata") or {}
+
+    with stage_duration.time(stage="vad"):
+        results = audio_segmenter.feed(
+            metadata.get("session_id"),
+            payload_bytes(payload, "bytes"),
+            sample_rate=payload.get("sample_rate") or settings.AUDIO_SAMPLE_RATE,
+            sample_width=payload.get("sample_width") or 2,
+            channels=payload.get("channels") or 1,
+        )
+
+    for kind, result in results:
+        if kind == "utterance":
+            audio = {"bytes": result} if event_bus.codecs.supports_bytes else {"blob": event_bus.put_blob(result)}
+            message = {
+                "type": "audio.raw",
+                "payload": {
+                    **audio,
+                    "size": len(result),
+                    "sample_rate": audio_segmenter.sample_rate,
+                    "sample_width": 2,
+                    "channels": 1,
+                },
+                "timestamp": timezone.now().isoformat(),
+                "metadata": metadata,
+            }
+            event_bus.publish(message["type"], message)
+        elif result:
+            publish_transcription(result, metadata, partial=kind == "partial")
 
-    recognized_faces, unrecognized_faces = face_recognition_service.detect_and_recognize_faces(data)
 
-    # Serialize each numpy array in the list to a Python list to prevent 'Object of type ndarray is not JSON serializable'
-    serialized_recognized_faces = [face.tolist() for face in recognized_faces] 
-    serialized_unrecognized_faces = [face.tolist() for face in unrecognized_faces]
+def preprocess_frame(params):
+    """
+    Frame preprocessing stage shared by the video.frame handlers.
+
+    Returns the decoded frame for this event from the frame cache, so the payload is
+    decoded once no matter how many handlers process it.
+    """
+    return frame_cache.get(params)
+
+
+@process_pool_handler
+def face_recognition(params):
+    frame = preprocess_frame(params)
+
+    session_id = (params.get("metadata") or {}).get("session_id")
+    recognized_faces, unrecognized_faces = face_recognition_service.detect_and_recognize_faces(frame, session_id=session_id)
 
     message = {
         "type": "face.detected",
         "payload": {
-            "recognized_faces": serialized_recognized_faces,
-            "unrecognized_faces": serialized_unrecognized_faces,
+            "recognized_faces": recognized_faces,
+            "unrecognized_faces": unrecognized_faces,
         },
         "timestamp": timezone.now().isoformat(),
-        "metadata": None,
+        "metadata": params.get("metadata"),
     }
 
     event_bus.publish(message["type"], message)
 
 
+def stream_response(context, metadata):
+    """
+    Stream the LLM response as assistant.response.delta events and return the full text.
+
+    Each delta carries its position in ``sequence`` so clients can order them, the
+    full response is published as assistant.response afterwards.
+    """
+    response = []
+
+    for sequence, delta in enumerate(llm_service.stream_text(context=context)):
+        response.append(delta)
+
+        message = {
+            "type": "assistant.response.delta",
+            "payload": {
+                "delta": delta,
+                "sequence": sequence,
+            },
+            "timestamp": timezone.now().isoformat(),
+            "metadata": metadata,
+        }
+
+        event_bus.publish(message["type"], message)
+
+    return "".join(response)
+
+
 def generate_response(params):
     payload = params.get("payload")
     transcription = payload.get("transcription")
+    session_id = (params.get("metadata") or {}).get("session_id")
 
-    messages = Message.objects.all().order_by("timestamp")
+    # The recent messages of this session, trimmed to the context token budget
+    conversation = conversation_cache.get(session_id)
     
     # Build the context for the LLM
-    context = llm_service.build_context(messages=messages)
+    with conversation.lock:
+        context = llm_service.build_context(messages=conversation.messages(), summary=conversation.summary)
 
     # Add the new user message to the context
     context.append({"role": "user", "content": transcription})
 
+    metadata = params.get("metadata")
+
     # Generate language using LLMService
-    response = llm_service.generate_text(context=context)
+    if settings.LLM_STREAMING:
+        response = stream_response(context, metadata)
+    else:
+        response = llm_service.generate_text(context=context)
 
     # Save messages to the database
-    Message.objects.bulk_create([
-        Message(role="user", content=transcription),
-        Message(role="assistant", content=response)
-    ])
+    with stage_duration.time(stage="db_save"):
+        Message.objects.bulk_create([
+            Message(role="user", content=transcription, session_id=session_id),
+            Message(role="assistant", content=response, session_id=session_id)
+        ])
 
     # Build event message
     message = {
@@ -81,36 +181,74 @@ def generate_response(params):
             "transcription": response,
         },
         "timestamp": timezone.now().isoformat(),
-        "metadata": None,
+        "metadata": metadata,
     }
 
     event_bus.publish(message["type"], message)
+
+    if settings.LLM_CONTEXT_SUMMARIZE:
+        summarize_conversation(conversation)
+
+
+def summarize_conversation(conversation):
+    """
+    Fold the turns trimmed from a conversation into its rolling summary.
+    """
+    with conversation.lock:
+        dropped, conversation.dropped = conversation.dropped, []
+        summary = conversation.summary
+
+    if dropped:
+        summary = llm_service.summarize(messages=dropped, summary=summary)
+        with conversation.lock:
+            conversation.summary = summary
     
 
+@process_pool_handler
 def process_emotions(params):
-    payload = params.get("payload")
-    data = payload.get("data")
+    frame = preprocess_frame(params)
+    session_id = (params.get("metadata") or {}).get("session_id")
+
+    emotions = emotion_service.detect_emotions(frame, session_id=session_id)
 
-    emotions = emotion_service.detect_emotions(data)
+    # Only publish results that changed noticeably
+    emotions = emotion_smoother.update(session_id, emotions)
+    if emotions is None:
+        return
 
     message = {
         "type": "face.emotion",
         "payload": {
             "emotions": emotions,
+            "dominant": dominant(emotions),
         },
         "timestamp": timezone.now().isoformat(),
-        "metadata": None,
+        "metadata": params.get("metadata"),
     }
 
     event_bus.publish(message["type"], message)
 
 
+@process_pool_handler
+def forget_faces(params):
+    """Drop the face tracker of a closed session, in the worker that holds it."""
+    face_detection.forget(params)
+
+
+@process_pool_handler
+def forget_emotions(params):
+    """Drop the smoothed emotions of a closed session, in the worker that holds them."""
+    emotion_smoother.forget(params)
+
+
+@defers_ack
 def save_event(params):
     """
     Save an event to the database.
 
     This function is triggered by the "event.save" event published to the event bus. 
-    It extracts event details from the provided parameters and saves them to the database.
+    It hands the event to the buffered event writer, which saves events to the database
+    in batches.
 
     Parameters:
         params (dict): The event payload passed to the function.
@@ -119,9 +257,4 @@ def save_event(params):
             - payload (dict): Contains the actual data of the event.
             - metadata (dict): Contains metadata of the event.
     """
-    Event.objects.create(
-        event_type=params.get("type"),
-        timestamp=params.get("timestamp"),
-        data=params.get("payload"),
-        metadata=params.get("metadata"),
-    )
+    event_writer.add(params)
@@ -0,0 +1,217 @@
+from django.conf import settings
+
+from events.metrics import handler_duration, handler_errors, metrics
+from events.streams import NO_ACK, defers_ack, take_ack
+from events.workers import run_handler
+
+from collections import deque
+import threading
+
+
+class SessionMailbox:
+    """
+    Bounded per-session mailbox for events, such as video frames.
+
+    The event bus only puts events in the mailbox, which returns immediately, while
+    worker threads run the handlers subscribed to their type. Each session holds at
+    most ``size`` events; when handlers fall behind the oldest events are dropped, so
+    results never lag more than ``size`` events behind the client.
+
+    Drop policies:
+        - latest: keep the most recent frames only.
+        - sample: only accept every ``sample_every``-th frame of a session, then
+          keep the most recent of those.
+
+    A session's events are processed in order by one worker at a time, sessions are
+    served round-robin, so handlers with per-session state never see a session's
+    events concurrently or out of order.
+
+    A closed session's ``session.closed`` handlers run after its queued events, and its
+    later events are dropped, so per-session state is never recreated after cleanup.
+
+    In streams mode an event's stream entry is acknowledged once its handlers ran, or
+    when it is dropped.
+    """
+
+    POLICIES = ("latest", "sample")
+    # Closed sessions remembered to drop their late events
+    CLOSED_SESSIONS = 10000
+
+    def __init__(self, name, size=1, policy="latest", sample_every=1, workers=1):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown frame drop policy {policy}")
+
+        self.name = name
+        self.size = size
+        self.policy = policy
+        self.sample_every = max(1, sample_every)
+        self.workers = workers
+        self.handlers = {}
+
+        self.queues = {}
+        self.received_by_session = {}
+        self.closed = {}
+        self.pending = deque()
+        self.active = set()
+        self.condition = threading.Condition()
+        self.started = False
+
+        # Counters
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def subscribe(self, event_name, handler):
+        """Subscribe a handler function to the events of a type leaving the mailbox."""
+        with self.condition:
+            self.handlers = {**self.handlers, event_name: self.handlers.get(event_name, ()) + (handler,)}
+
+    @defers_ack
+    def put(self, params):
+        """Queue an event, dropping events beyond the session's capacity."""
+        ack = take_ack(params)
+        session = (params.get("metadata") or {}).get("session_id") or "default"
+
+        with self.condition:
+            self.received += 1
+
+            if session in self.closed:
+                self.dropped += 1
+                ack.done()
+                return
+
+            if self.policy == "sample":
+                count = self.received_by_session.get(session, 0)
+                self.received_by_session[session] = count + 1
+                if count % self.sample_every:
+                    self.sampled_out += 1
+                    ack.done()
+                    return
+
+            queue = self.queues.setdefault(session, deque())
+            while len(queue) >= self.size:
+                queue.popleft()[1].done()
+                self.dropped += 1
+            queue.append((params, ack))
+            self._schedule(session)
+
+    def _schedule(self, session):
+        if session not in self.active and session not in self.pending:
+            self.pending.append(session)
+            self.condition.notify()
+
+    def _take(self):
+        """Block until a session has frames and no worker is busy with it."""
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+
+            session = self.pending.popleft()
+            self.active.add(session)
+            return session, self.queues[session].popleft()
+
+    def _release(self, session):
+        with self.condition:
+            self.active.discard(session)
+            if self.queues.get(session):
+                self.pending.append(session)
+                self.condition.notify()
+            else:
+                self.queues.pop(session, None)
+
+    def _worker(self):
+        while True:
+            session, (params, ack) = self._take()
+            event_name = params.get("type")
+            try:
+                for handler in self.handlers.get(event_name, ()):
+                    try:
+                        with handler_duration.time(event=event_name, handler=handler.__name__):
+                            run_handler(handler, params)
+                    except Exception as handler_error:
+                        handler_errors.inc(event=event_name, handler=handler.__name__)
+                        print(f"Error in handler for {event_name}: {handler_error}")
+            finally:
+                with self.condition:
+                    self.processed += 1
+                ack.done()
+                self._release(session)
+
+    def close(self, params):
+        """Queue the end of a session that disconnected, subscribed to session.closed."""
+        session = (params.get("metadata") or {}).get("session_id")
+        if not session:
+            return
+
+        with self.condition:
+            self.received_by_session.pop(session, None)
+            self.closed[session] = True
+            if len(self.closed) > self.CLOSED_SESSIONS:
+                del self.closed[next(iter(self.closed))]
+
+            # Never dropped for capacity: no event of the session is queued after it
+            self.queues.setdefault(session, deque()).append((params, NO_ACK))
+            self._schedule(session)
+
+    def start(self):
+        """Start the worker threads."""
+        with self.condition:
+            if self.started:
+                return
+            self.started = True
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"{self.name}-mailbox-{i}")
+            thread.daemon = True
+            thread.start()
+
+    def stats(self):
+        """Counters and current queue depth."""
+        with self.condition:
+            return {
+                "received": self.received,
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "sampled_out": self.sampled_out,
+                "depth": sum(len(queue) for queue in self.queues.values()),
+                "sessions": len(self.queues),
+            }
+
+
+video_frame_mailbox = SessionMailbox(
+    "video-frame",
+    size=settings.VIDEO_FRAME_MAILBOX_SIZE,
+    policy=settings.VIDEO_FRAME_POLICY,
+    sample_every=settings.VIDEO_FRAME_SAMPLE_EVERY,
+    workers=settings.VIDEO_FRAME_WORKERS,
+)
+
+metrics.gauge("video_frame_mailbox_depth", "Video frames waiting in the mailbox", lambda: video_frame_mailbox.stats()["depth"])
+metrics.gauge("video_frame_mailbox_frames", "Video frames received, processed, dropped or sampled out by the mailbox", lambda: {
+    (("state", state),): value for state, value in video_frame_mailbox.stats().items() if state not in ("depth", "sessions")
+})
+
+# Speech handlers keep per-session state (utterances, conversations), so a session's audio and
+# transcriptions are handled in order while sessions are served concurrently. Replies are
+# generated in their own mailbox, so a long LLM call doesn't hold up the session's audio.
+audio_mailbox = SessionMailbox("audio", size=settings.AUDIO_MAILBOX_SIZE, workers=settings.SPEECH_WORKERS)
+response_mailbox = SessionMailbox("response", size=settings.RESPONSE_MAILBOX_SIZE, workers=settings.SPEECH_WORKERS)
+
+
+def _register_gauges(mailbox):
+    metrics.gauge(
+        f"{mailbox.name}_mailbox_depth", f"Events waiting in the {mailbox.name} mailbox",
+        lambda: mailbox.stats()["depth"],
+    )
+    metrics.gauge(
+        f"{mailbox.name}_mailbox_events", f"Events received, processed or dropped by the {mailbox.name} mailbox",
+        lambda: {
+            (("state", state),): value
+            for state, value in mailbox.stats().items() if state in ("received", "processed", "dropped")
+        },
+    )
+
+
+_register_gauges(audio_mailbox)
+_register_gauges(response_mailbox)
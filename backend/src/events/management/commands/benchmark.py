@@ -0,0 +1,364 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from virtual_humans.protocol import KIND_AUDIO_RAW, KIND_VIDEO_FRAME, pack_message
+
+from collections import deque
+from pathlib import Path
+import numpy as np
+import aiohttp
+import asyncio
+import base64
+import json
+import math
+import time
+import wave
+import cv2
+import os
+import re
+
+
+SAMPLE_LINE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+# Distinct frames sent in turn, so no frame is a repeat of the previous ones
+FRAME_VARIANTS = 30
+
+# Results where a lower value is better, every other result is better when higher
+LOWER_IS_BETTER = ("latency", "stages", "processes", "errors", "dropped")
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = np.asarray(values)
+    return {
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "count": len(values),
+    }
+
+
+def parse_metrics(text):
+    """Parse Prometheus text into {(name, ((label, value), ...)): value}."""
+    samples = {}
+    for line in text.splitlines():
+        match = SAMPLE_LINE.match(line)
+        if line.startswith("#") or not match:
+            continue
+        name, labels, value = match.groups()
+        samples[(name, tuple(sorted(LABEL.findall(labels or ""))))] = float(value)
+    return samples
+
+
+def histogram_percentiles(start, end, name, label):
+    """Estimate percentiles per ``label`` value of a histogram from the bucket increments."""
+    buckets = {}
+    for (sample, labels), value in end.items():
+        if sample != f"{name}_bucket":
+            continue
+        increment = value - start.get((sample, labels), 0)
+        labels = dict(labels)
+        bound = math.inf if labels["le"] == "+Inf" else float(labels["le"])
+        buckets.setdefault(labels.get(label), []).append((bound, increment))
+
+    results = {}
+    for group, group_buckets in buckets.items():
+        # Sum label sets that share the grouping label, e.g. every handler of an event
+        per_bound = {}
+        for bound, increment in group_buckets:
+            per_bound[bound] = per_bound.get(bound, 0) + increment
+        bounds = sorted(per_bound)
+        total = per_bound[bounds[-1]]
+        if total <= 0:
+            continue
+
+        result = {"count": int(total)}
+        for quantile in (50, 95, 99):
+            rank, lower = total * quantile / 100, 0.0
+            for i, bound in enumerate(bounds):
+                if per_bound[bound] >= rank:
+                    previous = per_bound[bounds[i - 1]] if i else 0
+                    upper = bound if bound != math.inf else lower
+                    fraction = (rank - previous) / (per_bound[bound] - previous) if per_bound[bound] > previous else 1
+                    result[f"p{quantile}"] = lower + (upper - lower) * fraction
+                    break
+                lower = bound
+        results[group] = result
+    return results
+
+
+def process_usage(pid):
+    """CPU seconds and resident memory in bytes of a process, from /proc."""
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    rss = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+    return cpu, rss
+
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the ws/ pipeline with concurrent clients streaming video frames and audio. "
+        "Run the server with SPEECH_BACKEND=stub and LLM_BASE_URL pointing at the stub_llm command "
+        "to measure the pipeline itself instead of the external services."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="ws://127.0.0.1:8000/ws/")
+        parser.add_argument("--metrics-url", default="http://127.0.0.1:8000/metrics", help="Empty to skip server metrics")
+        parser.add_argument("--clients", type=int, default=10)
+        parser.add_argument("--duration", type=float, default=30, help="Seconds of load")
+        parser.add_argument("--ramp-up", type=float, default=5, help="Seconds over which the clients connect")
+        parser.add_argument("--fps", type=float, default=10, help="Video frames per second per client, 0 disables video")
+        parser.add_argument("--audio-interval", type=float, default=5, help="Seconds between utterances per client, 0 disables audio")
+        parser.add_argument("--frame", help="JPEG file sent as video frame, a synthetic 640x480 frame by default")
+        parser.add_argument("--audio", help="WAV file sent as utterance, 2 seconds of synthetic audio by default")
+        parser.add_argument("--binary", action="store_true", help="Send binary messages instead of base64 JSON")
+        parser.add_argument("--server-pid", type=int, action="append", default=[], help="Server process to measure CPU and RSS of")
+        parser.add_argument("--output", help="Write the results to this JSON file")
+        parser.add_argument("--baseline", help="Compare the results with a previous results file")
+        parser.add_argument("--tolerance", type=float, default=0.1, help="Relative change reported as regression")
+        parser.add_argument("--fail-on-regression", action="store_true")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.frames = self.load_frames(options["frame"])
+        self.audio = self.load_audio(options["audio"])
+
+        results = asyncio.run(self.run())
+
+        self.stdout.write(json.dumps(results, indent=2))
+        if options["output"]:
+            Path(options["output"]).write_text(json.dumps(results, indent=2))
+
+        if options["baseline"]:
+            regressions = self.compare(results, json.loads(Path(options["baseline"]).read_text()))
+            if regressions and options["fail_on_regression"]:
+                raise CommandError(f"{len(regressions)} results regressed more than {options['tolerance']:.0%}")
+
+    def load_frames(self, path):
+        """
+        JPEG frames that all differ, like a camera's: the image with a frame counter and
+        sensor-like noise, so the server decodes and analyzes every frame it receives.
+        """
+        if path:
+            image = cv2.imread(path)
+            if image is None:
+                raise CommandError(f"Could not read frame {path}")
+        else:
+            # Smooth gradients with a few shapes, compresses like a camera image would
+            y, x = np.mgrid[0:480, 0:640]
+            image = np.dstack([x * 255 // 640, y * 255 // 480, (x + y) * 255 // 1120]).astype(np.uint8)
+            cv2.circle(image, (320, 200), 90, (180, 200, 230), -1)
+            cv2.rectangle(image, (60, 320), (200, 460), (40, 90, 160), -1)
+
+        rng = np.random.default_rng(0)
+        frames = []
+        for i in range(FRAME_VARIANTS):
+            noise = rng.integers(-4, 5, image.shape, dtype=np.int16)
+            variant = np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+            cv2.putText(variant, str(i), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+            frames.append(cv2.imencode(".jpg", variant, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes())
+        return frames
+
+    def load_audio(self, path):
+        if path:
+            with wave.open(path, "rb") as wav:
+                return wav.readframes(wav.getnframes()), wav.getframerate(), wav.getsampwidth(), wav.getnchannels()
+
+        t = np.arange(0, 2, 1 / 16000)
+        samples = (0.3 * np.sin(2 * np.pi * 220 * t) * np.sin(2 * np.pi * 3 * t) * 32767).astype("<i2")
+        return samples.tobytes(), 16000, 2, 1
+
+    def frame_messages(self):
+        """One message per frame variant, encoded up front so sending costs no CPU."""
+        if self.options["binary"]:
+            return [pack_message(KIND_VIDEO_FRAME, frame) for frame in self.frames]
+        return [
+            json.dumps({"type": "video.frame", "payload": {"data": base64.b64encode(frame).decode()}})
+            for frame in self.frames
+        ]
+
+    def audio_message(self):
+        audio, sample_rate, sample_width, channels = self.audio
+        if self.options["binary"]:
+            return pack_message(KIND_AUDIO_RAW, audio, sample_rate=sample_rate, sample_width=sample_width, channels=channels)
+        return json.dumps({"type": "audio.raw", "payload": {
+            "bytes": base64.b64encode(audio).decode(),
+            "sample_rate": sample_rate,
+            "sample_width": sample_width,
+            "channels": channels,
+        }})
+
+    async def send_periodically(self, ws, interval, messages, stats, on_send=None):
+        """Send the messages in turn every ``interval`` seconds until the deadline."""
+        deadline = self.deadline
+        next_send = time.monotonic()
+        while next_send < deadline:
+            await asyncio.sleep(max(0, next_send - time.monotonic()))
+            if on_send:
+                on_send()
+            message = messages[stats["sent"] % len(messages)]
+            if isinstance(message, bytes):
+                await ws.send_bytes(message)
+            else:
+                await ws.send_str(message)
+            stats["sent"] += 1
+            next_send += interval
+
+    async def client(self, session, index, results):
+        await asyncio.sleep(self.options["ramp_up"] * index / max(1, self.options["clients"]))
+
+        frames = {"sent": 0}
+        utterances = {"sent": 0}
+        pending = deque()
+        first_token_pending = deque()
+
+        try:
+            async with session.ws_connect(self.options["url"], max_msg_size=0) as ws:
+                message = await ws.receive_json()
+                if message.get("type") != "connection_established":
+                    raise ValueError(f"Unexpected first message {message.get('type')}")
+
+                def utterance_sent():
+                    now = time.monotonic()
+                    pending.append(now)
+                    first_token_pending.append(now)
+
+                senders = []
+                if self.options["fps"] > 0:
+                    senders.append(asyncio.create_task(
+                        self.send_periodically(ws, 1 / self.options["fps"], self.frame_messages(), frames)
+                    ))
+                if self.options["audio_interval"] > 0:
+                    senders.append(asyncio.create_task(self.send_periodically(
+                        ws, self.options["audio_interval"], [self.audio_message()], utterances, utterance_sent
+                    )))
+
+                # Responses to the last utterances may arrive after the load stopped
+                receive_until = self.deadline + 30
+                while time.monotonic() < receive_until and (not all(s.done() for s in senders) or pending):
+                    try:
+                        message = await ws.receive(timeout=max(0.1, receive_until - time.monotonic()))
+                    except asyncio.TimeoutError:
+                        break
+                    if message.type != aiohttp.WSMsgType.TEXT:
+                        if message.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+                        continue
+
+                    data = json.loads(message.data)
+                    if data.get("type") == "assistant.response.delta" and data["payload"].get("sequence") == 0 and first_token_pending:
+                        results["first_token"].append(time.monotonic() - first_token_pending.popleft())
+                    elif data.get("type") == "assistant.response" and pending:
+                        results["response"].append(time.monotonic() - pending.popleft())
+
+                for sender in senders:
+                    sender.cancel()
+        except (aiohttp.ClientError, ValueError) as e:
+            results["errors"].append(str(e))
+
+        results["frames_sent"] += frames["sent"]
+        results["utterances_sent"] += utterances["sent"]
+        results["unanswered"] += len(pending)
+
+    async def scrape(self, session):
+        if not self.options["metrics_url"]:
+            return {}
+        try:
+            async with session.get(self.options["metrics_url"]) as response:
+                return parse_metrics(await response.text())
+        except aiohttp.ClientError as e:
+            self.stderr.write(f"Failed to scrape metrics: {e}")
+            return {}
+
+    async def sample_processes(self, peak_rss):
+        while True:
+            for pid in self.options["server_pid"]:
+                try:
+                    peak_rss[pid] = max(peak_rss.get(pid, 0), process_usage(pid)[1])
+                except OSError:
+                    pass
+            await asyncio.sleep(1)
+
+    async def run(self):
+        results = {"response": [], "first_token": [], "errors": [], "frames_sent": 0, "utterances_sent": 0, "unanswered": 0}
+        peak_rss = {}
+
+        async with aiohttp.ClientSession() as session:
+            metrics_start = await self.scrape(session)
+            cpu_start = {pid: process_usage(pid)[0] for pid in self.options["server_pid"]}
+            sampler = asyncio.create_task(self.sample_processes(peak_rss))
+
+            start = time.monotonic()
+            self.deadline = start + self.options["ramp_up"] + self.options["duration"]
+            await asyncio.gather(*(self.client(session, i, results) for i in range(self.options["clients"])))
+            elapsed = time.monotonic() - start
+
+            sampler.cancel()
+            metrics_end = await self.scrape(session)
+            cpu_end = {pid: process_usage(pid)[0] for pid in self.options["server_pid"]}
+
+        def increase(name, **labels):
+            key = (name, tuple(sorted(labels.items())))
+            return metrics_end.get(key, 0) - metrics_start.get(key, 0)
+
+        load_seconds = self.options["duration"] + self.options["ramp_up"] / 2
+        return {
+            "config": {key: self.options[key] for key in ("clients", "duration", "ramp_up", "fps", "audio_interval", "binary")},
+            "throughput": {
+                "fps_sent": results["frames_sent"] / load_seconds,
+                "fps_processed": increase("video_frame_mailbox_frames", state="processed") / load_seconds,
+                "utterances_sent": results["utterances_sent"],
+            },
+            "dropped": {
+                "frames": increase("video_frame_mailbox_frames", state="dropped"),
+                "unanswered_utterances": results["unanswered"],
+                "outbox_events": increase("websocket_outbox_dropped_total"),
+            },
+            "latency": {
+                "response": percentiles(results["response"]),
+                "first_token": percentiles(results["first_token"]),
+                "events": histogram_percentiles(metrics_start, metrics_end, "event_latency_seconds", "event"),
+                "pipeline": histogram_percentiles(metrics_start, metrics_end, "event_pipeline_latency_seconds", "event"),
+            },
+            "stages": histogram_percentiles(metrics_start, metrics_end, "pipeline_stage_duration_seconds", "stage"),
+            "processes": {
+                str(pid): {
+                    "cpu": (cpu_end[pid] - cpu_start[pid]) / elapsed * 100,
+                    "rss_peak": peak_rss.get(pid, 0) / 2 ** 20,
+                }
+                for pid in self.options["server_pid"]
+            },
+            "errors": len(results["errors"]),
+        }
+
+    def compare(self, results, baseline):
+        """Print the change of every result against the baseline and return the regressions."""
+        current, previous = flatten(results), flatten(baseline)
+        regressions = []
+
+        self.stdout.write(f"\n{'result':<55} {'baseline':>12} {'current':>12} {'change':>9}")
+        for name in sorted(current.keys() & previous.keys()):
+            if name.startswith("config.") or name.endswith(".count"):
+                continue
+            old, new = previous[name], current[name]
+            change = (new - old) / old if old else 0.0
+            worse = change > self.options["tolerance"] if name.startswith(LOWER_IS_BETTER) else change < -self.options["tolerance"]
+            if worse:
+                regressions.append(name)
+            self.stdout.write(f"{name:<55} {old:>12.4f} {new:>12.4f} {change:>+8.1%}{' !' if worse else ''}")
+
+        return regressions
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from events.models import Event
+
+from datetime import timedelta
+import time
+
+
+class Command(BaseCommand):
+    help = "Delete and downsample old events of the event log according to EVENT_RETENTION_POLICIES"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows deleted per statement")
+        parser.add_argument("--pause", type=float, default=0.1, help="Seconds to sleep between batches")
+        parser.add_argument("--dry-run", action="store_true", help="Only count the events that would be deleted")
+
+    def _delete(self, events, label, options):
+        """Delete events in batches of primary keys, so no statement locks the table for long."""
+        if options["dry_run"]:
+            self.stdout.write(f"{label}: {events.count()} events would be deleted")
+            return
+
+        deleted = 0
+        while True:
+            ids = list(events.order_by().values_list("id", flat=True)[:options["batch_size"]])
+            if not ids:
+                break
+            deleted += Event.objects.filter(id__in=ids).delete()[0]
+            time.sleep(options["pause"])
+        self.stdout.write(f"{label}: deleted {deleted} events")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        policies = settings.EVENT_RETENTION_POLICIES
+
+        for event_type, policy in policies.items():
+            events = Event.objects.filter(event_type=event_type)
+
+            max_age_days = policy.get("max_age_days", settings.EVENT_RETENTION_DAYS)
+            if max_age_days:
+                self._delete(events.filter(timestamp__lt=now - timedelta(days=max_age_days)), event_type, options)
+
+            # Keeping rows by id makes the downsampling idempotent: a second run deletes nothing
+            keep_every = policy.get("keep_every", 1)
+            if keep_every > 1:
+                cutoff = now - timedelta(days=policy.get("downsample_after_days", 0))
+                thinned = events.filter(timestamp__lt=cutoff).alias(keep=Mod("id", keep_every)).exclude(keep=0)
+                self._delete(thinned, f"{event_type} (keeping every {keep_every})", options)
+
+        if settings.EVENT_RETENTION_DAYS:
+            expired = Event.objects.exclude(event_type__in=policies.keys()).filter(
+                timestamp__lt=now - timedelta(days=settings.EVENT_RETENTION_DAYS)
+            )
+            self._delete(expired, "other events", options)
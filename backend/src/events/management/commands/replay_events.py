@@ -0,0 +1,219 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from events.event_bus import event_bus
+from events.models import Event
+from events.storage import storage_policy
+
+import threading
+import redis
+import json
+import time
+import uuid
+
+
+# Events sent by clients, everything else is produced by the handlers
+INPUT_EVENTS = ("audio.raw", "audio.chunk", "video.frame", "session.closed")
+
+
+class EventCapture:
+    """
+    Collects the events of one replay run from ``event.save``.
+
+    Every published event goes to ``event.save``, so reading it sees the output of
+    every handler in any process. It is read without taking part in its consumer group
+    (a plain XREAD in streams mode), so the event writer still receives everything.
+    """
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.events = []
+        self.stopping = threading.Event()
+        self.client = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+        self.thread = None
+
+    def _collect(self, message):
+        data = event_bus._decode(message)
+        if data is None:
+            return
+        if (data.get("metadata") or {}).get("replay") == self.run_id and data.get("type") not in INPUT_EVENTS:
+            self.events.append(data)
+
+    def _read_pubsub(self, pubsub):
+        while not self.stopping.is_set():
+            message = pubsub.get_message(ignore_subscribe_messages=True, timeout=0.5)
+            if message is not None and message["type"] == "message":
+                self._collect(message["data"])
+        pubsub.close()
+
+    def _read_stream(self, key, last_id):
+        while not self.stopping.is_set():
+            for _, entries in self.client.xread({key: last_id}, count=500, block=500) or ():
+                for last_id, fields in entries:
+                    self._collect(fields.get(b"m"))
+
+    def start(self):
+        """Start reading, before the first event is published."""
+        if event_bus.streams is not None:
+            key = event_bus.streams.key("event.save")
+            last = self.client.xrevrange(key, count=1)
+            target, args = self._read_stream, (key, last[0][0] if last else "0-0")
+        else:
+            pubsub = self.client.pubsub()
+            pubsub.subscribe("event.save")
+            target, args = self._read_pubsub, (pubsub,)
+
+        self.thread = threading.Thread(target=target, args=args, name="replay-capture")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join(timeout=5)
+        return self.events
+
+
+def event_key(data):
+    """Compared fields of an event, without the ones that differ on every run."""
+    return json.dumps(data.get("payload"), sort_keys=True, default=str)
+
+
+class Command(BaseCommand):
+    help = "Replay the stored input events of a time range or session on the event bus and diff the output"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--session", action="append", default=[], help="Session to replay, can be repeated")
+        parser.add_argument("--since", help="Start of the time range (ISO 8601)")
+        parser.add_argument("--until", help="End of the time range (ISO 8601)")
+        parser.add_argument(
+            "--type", action="append", dest="types",
+            help=f"Event type to replay, can be repeated. Defaults to {', '.join(INPUT_EVENTS[:-1])}",
+        )
+        parser.add_argument("--speed", type=float, default=1.0, help="Replay speed, 1 is real time, 10 ten times faster")
+        parser.add_argument("--fast", action="store_true", help="Replay as fast as possible")
+        parser.add_argument("--settle", type=float, default=10, help="Seconds to wait for output after the last event")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Rows fetched per round trip")
+        parser.add_argument("--output", help="Write the captured events to this JSON lines file")
+        parser.add_argument("--show", type=int, default=5, help="Differing events to print per event type")
+
+    def _datetime(self, value, name):
+        if not value:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise CommandError(f"Invalid {name} {value}")
+        return parsed
+
+    def _events(self, options):
+        """The selected stored events, in time order."""
+        events = Event.objects.history(since=options["since"], until=options["until"])
+        if options["session"]:
+            events = events.filter(session_id__in=options["session"])
+        return events
+
+    def handle(self, *args, **options):
+        options["since"] = self._datetime(options["since"], "since")
+        options["until"] = self._datetime(options["until"], "until")
+        if not (options["session"] or options["since"] or options["until"]):
+            raise CommandError("Select the events to replay with --session, --since or --until")
+        if options["speed"] <= 0:
+            raise CommandError("--speed must be positive")
+
+        run_id = uuid.uuid4().hex[:8]
+        event_types = options["types"] or INPUT_EVENTS[:-1]
+        sessions = {}
+
+        capture = EventCapture(run_id)
+        capture.start()
+
+        # A server-side cursor on Postgres, memory stays flat however many rows are replayed
+        start = time.monotonic()
+        first = None
+        published = 0
+        events = self._events(options).filter(event_type__in=event_types)
+        for event in events.iterator(chunk_size=options["chunk_size"]):
+            if first is None:
+                first = event.timestamp
+            if not options["fast"]:
+                delay = (event.timestamp - first).total_seconds() / options["speed"] - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+
+            # Replayed sessions get their own id, so they never share state with live ones
+            session_id = sessions.setdefault(event.session_id, f"replay-{run_id}-{event.session_id}"[:64])
+            timestamp = timezone.now().isoformat()
+            event_bus.publish(event.event_type, {
+                "type": event.event_type,
+                "payload": storage_policy.resolve(event.data),
+                "timestamp": timestamp,
+                "metadata": {
+                    **(event.metadata or {}),
+                    "session_id": session_id,
+                    "replay": run_id,
+                    "origin_type": event.event_type,
+                    "origin_timestamp": timestamp,
+                },
+            })
+            published += 1
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(
+            f"Replay {run_id}: published {published} events of {len(sessions)} sessions in {elapsed:.1f}s "
+            f"({published / max(elapsed, 1e-9):.1f} events/s)"
+        )
+
+        time.sleep(options["settle"])
+        for session_id in sessions.values():
+            event_bus.publish("session.closed", {
+                "type": "session.closed",
+                "payload": {},
+                "timestamp": timezone.now().isoformat(),
+                "metadata": {"session_id": session_id, "replay": run_id},
+            })
+        captured = capture.stop()
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                for data in captured:
+                    f.write(json.dumps(data, default=str) + "\n")
+
+        self.diff(options, event_types, sessions, captured)
+
+    def diff(self, options, event_types, sessions, captured):
+        """
+        Compare the captured events with the stored output of the original sessions, per
+        session and type, in order. Event types the storage policy skips are not compared.
+        """
+        originals = {session_id: original for original, session_id in sessions.items()}
+        replayed = {}
+        for data in captured:
+            if storage_policy.policies.get(data.get("type"), {}).get("skip"):
+                continue
+            session_id = originals.get((data.get("metadata") or {}).get("session_id"))
+            replayed.setdefault((session_id, data.get("type")), []).append(data)
+
+        expected = {}
+        outputs = self._events(options).exclude(event_type__in=set(INPUT_EVENTS) | set(event_types))
+        for event in outputs.iterator(chunk_size=options["chunk_size"]):
+            if event.session_id in sessions:
+                expected.setdefault((event.session_id, event.event_type), []).append({"payload": event.data})
+
+        totals = {}
+        for key in sorted(set(expected) | set(replayed), key=lambda key: (str(key[0]), str(key[1]))):
+            before, after = expected.get(key, []), replayed.get(key, [])
+            differing = [
+                (i, a, b) for i, (a, b) in enumerate(zip(before, after)) if event_key(a) != event_key(b)
+            ]
+            counts = totals.setdefault(key[1], [0, 0, 0])
+            counts[0] += len(before)
+            counts[1] += len(after)
+            counts[2] += len(differing)
+
+            for i, a, b in differing[:options["show"]]:
+                self.stdout.write(f"{key[0]} {key[1]} #{i}:\n  - {event_key(a)}\n  + {event_key(b)}")
+
+        self.stdout.write(f"{'Event':<32}{'Original':>10}{'Replayed':>10}{'Differing':>10}")
+        for event_type, (before, after, differing) in sorted(totals.items()):
+            self.stdout.write(f"{event_type:<32}{before:>10}{after:>10}{differing:>10}")
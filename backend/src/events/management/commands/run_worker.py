@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from events.metrics import metrics
+from events.persistence import event_writer
+from events.subscribers import ROLES, initialize_listeners
+
+import signal
+import time
+
+
+class Command(BaseCommand):
+    help = "Run the event handlers of one or more process roles without serving WebSockets"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--role", action="append", choices=[role for role in ROLES if role != "web"], dest="roles",
+            help="Role to run, can be repeated. Defaults to EVENTS_ROLES without web.",
+        )
+        parser.add_argument(
+            "--metrics-port", type=int, default=settings.WORKER_METRICS_PORT,
+            help="Port serving the worker's metrics in the Prometheus text format, 0 to disable",
+        )
+
+    def _terminate(self, signum, frame):
+        # Stop like on Ctrl-C, so queued events are still written
+        raise KeyboardInterrupt
+
+    def handle(self, *args, **options):
+        roles = options["roles"] or [role for role in settings.EVENTS_ROLES if role not in ("web", "none")]
+        if not roles:
+            raise CommandError("No roles to run")
+
+        signal.signal(signal.SIGTERM, self._terminate)
+        initialize_listeners(roles)
+        if options["metrics_port"]:
+            metrics.serve(options["metrics_port"])
+        self.stdout.write(f"Worker running roles: {', '.join(roles)}")
+
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if "persistence" in roles:
+                event_writer.stop()
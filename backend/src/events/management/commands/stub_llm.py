@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand
+
+from aiohttp import web
+import asyncio
+import json
+import time
+import uuid
+
+
+class Command(BaseCommand):
+    help = "Run a local stub of the OpenAI chat completions endpoint, point LLM_BASE_URL at http://<host>:<port>/v1"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8090)
+        parser.add_argument("--response", default="Dat klinkt fijn. Vertel me er gerust meer over, ik luister.")
+        parser.add_argument("--first-token-delay", type=float, default=0.2, help="Seconds before the first token")
+        parser.add_argument("--token-delay", type=float, default=0.02, help="Seconds between tokens")
+
+    def handle(self, *args, **options):
+        self.options = options
+
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        web.run_app(app, host=options["host"], port=options["port"], print=self.stdout.write)
+
+    def tokens(self):
+        """Split the canned response in word-sized tokens, keeping the whitespace."""
+        words = self.options["response"].split(" ")
+        return [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+    def chunk(self, completion_id, model, delta, finish_reason=None):
+        return {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        model = body.get("model", "stub")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        tokens = self.tokens()[:body.get("max_tokens") or None]
+
+        await asyncio.sleep(self.options["first_token_delay"])
+
+        if not body.get("stream"):
+            await asyncio.sleep(self.options["token_delay"] * len(tokens))
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(data):
+            await response.write(f"data: {data}\n\n".encode())
+
+        await send(json.dumps(self.chunk(completion_id, model, {"role": "assistant", "content": ""})))
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(self.options["token_delay"])
+            await send(json.dumps(self.chunk(completion_id, model, {"content": token})))
+        await send(json.dumps(self.chunk(completion_id, model, {}, finish_reason="stop")))
+        await send("[DONE]")
+
+        await response.write_eof()
+        return response
@@ -0,0 +1,244 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import threading
+import bisect
+import time
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a fast handler to a slow LLM response
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    values = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + values + "}"
+
+
+def _format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Counter:
+    """A monotonically increasing count per label set."""
+
+    type = "counter"
+
+    def __init__(self, registry, name, help):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        self.registry.record(self, amount, labels)
+
+    def _apply(self, value, labels):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, labels, (), value
+
+
+class Histogram:
+    """Observations counted in cumulative buckets per label set."""
+
+    type = "histogram"
+
+    def __init__(self, registry, name, help, buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+
+    def observe(self, value, **labels):
+        self.registry.record(self, value, labels)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the ``with`` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _apply(self, value, labels):
+        counts, total = self.values.get(labels) or ([0] * (len(self.buckets) + 1), 0.0)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.values[labels] = (counts, total + value)
+
+    def samples(self):
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                yield f"{self.name}_bucket", labels, (("le", le),), cumulative
+            yield f"{self.name}_sum", labels, (), total
+            yield f"{self.name}_count", labels, (), cumulative
+
+
+class Gauge:
+    """Values read from a callback when the metrics are rendered."""
+
+    type = "gauge"
+
+    def __init__(self, registry, name, help, callback):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.callback = callback
+
+    def samples(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            yield self.name, labels, (), value
+
+
+class MetricsRegistry:
+    """
+    In-process metrics, rendered in the Prometheus text exposition format.
+
+    Worker processes of the vision pool can't be scraped, so there observations are
+    buffered instead and sent back with the result of every handler call (see
+    ``events.workers``), where ``replay`` records them in the parent's registry.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.buffer = None
+
+    def _register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help):
+        return self._register(Counter(self, name, help))
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help, buckets))
+
+    def gauge(self, name, help, callback):
+        return self._register(Gauge(self, name, help, callback))
+
+    def record(self, metric, value, labels):
+        labels = _labels(labels)
+        with self.lock:
+            if self.buffer is not None:
+                self.buffer.append((metric.name, value, labels))
+            else:
+                metric._apply(value, labels)
+
+    def start_buffering(self):
+        """Buffer observations to be sent to another process instead of recording them."""
+        self.buffer = []
+
+    def drain(self):
+        """Take the buffered observations."""
+        with self.lock:
+            observations, self.buffer = self.buffer, []
+        return observations
+
+    def replay(self, observations):
+        """Record observations drained in another process."""
+        with self.lock:
+            for name, value, labels in observations or ():
+                metric = self.metrics.get(name)
+                if metric is not None:
+                    metric._apply(value, labels)
+
+    def render(self):
+        """All metrics in the Prometheus text format."""
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+            samples = {metric.name: list(metric.samples()) for metric in metrics if not isinstance(metric, Gauge)}
+
+        for metric in metrics:
+            try:
+                metric_samples = samples[metric.name] if metric.name in samples else list(metric.samples())
+            except Exception as e:
+                print(f"Failed to collect metric {metric.name}: {e}")
+                continue
+
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, extra, value in metric_samples:
+                lines.append(f"{name}{_format_labels(labels, extra)} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="0.0.0.0"):
+        """Serve the metrics over HTTP on a background thread, for processes without a web server."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever, name="metrics-server")
+        thread.daemon = True
+        thread.start()
+        return server
+
+
+def event_age(data):
+    """Seconds since the ISO 8601 ``timestamp`` of an event, None when it has none."""
+    return age(data.get("timestamp"))
+
+
+def age(value):
+    """Seconds since an ISO 8601 timestamp, None when it isn't one."""
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - timestamp).total_seconds()
+
+
+metrics = MetricsRegistry()
+
+events_published = metrics.counter("events_published_total", "Events published on the event bus")
+events_consumed = metrics.counter("events_consumed_total", "Events received from the event bus")
+event_latency = metrics.histogram(
+    "event_latency_seconds", "Time from the event timestamp until a process received the event"
+)
+pipeline_latency = metrics.histogram(
+    "event_pipeline_latency_seconds",
+    "Time from the client event a result derives from (origin) until the result was published",
+)
+handler_duration = metrics.histogram("event_handler_duration_seconds", "Duration of event handler calls")
+handler_errors = metrics.counter("event_handler_errors_total", "Event handler calls that raised")
+handler_dropped = metrics.counter("event_handler_dropped_total", "Events dropped because a handler's queue was full")
+stage_duration = metrics.histogram("pipeline_stage_duration_seconds", "Duration of the processing stages")
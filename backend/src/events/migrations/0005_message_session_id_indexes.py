@@ -0,0 +1,28 @@
+# Generated by Django 4.1.5 on 2026-10-18 11:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('events', '0004_faceidentity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='session_id',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['user', 'timestamp'], name='events_mess_user_id_7f4fa7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['session_id', 'timestamp'], name='events_mess_session_4c6696_idx'),
+        ),
+    ]
@@ -1,19 +1,61 @@
+from django.contrib.postgres.indexes import BrinIndex
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
 import uuid
 
+
+class EventQuerySet(models.QuerySet):
+
+    def history(self, session_id=None, event_types=None, since=None, until=None):
+        """Events in time order, optionally of one session, some types and a time range."""
+        events = self
+        if session_id:
+            events = events.filter(session_id=session_id)
+        if event_types:
+            events = events.filter(event_type__in=event_types)
+        if since:
+            events = events.filter(timestamp__gte=since)
+        if until:
+            events = events.filter(timestamp__lt=until)
+        return events.order_by("timestamp", "id")
+
+    def after(self, timestamp, id):
+        """Events after the (timestamp, id) keyset cursor of the last event of a page."""
+        return self.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=id))
+
+
 class Event(models.Model):
     """
     Stores event messages
     """
     event_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     event_type = models.CharField(max_length=255)
-    timestamp = models.DateTimeField(auto_now_add=True) 
+    timestamp = models.DateTimeField(default=timezone.now) # When the event was published
     data = models.JSONField() 
     metadata = models.JSONField(null=True, blank=True) # TODO: Future proofing for versioning and user_id?
+    session_id = models.CharField(max_length=64, blank=True, null=True) # Copied from metadata for indexing
+
+    objects = EventQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["event_type", "timestamp"]),
+            models.Index(fields=["session_id", "timestamp"]),
+            # Rows are appended in time order, a block range index stays tiny at any size
+            BrinIndex(fields=["timestamp"]),
+        ]
 
     def __str__(self):
         return f"{self.event_type} - {self.event_id}"
 
+    def resolved_data(self):
+        """
+        Event data with payload fields stored in the blob store resolved to base64 strings
+        """
+        from events.storage import storage_policy
+        return storage_policy.resolve(self.data)
+
 
 class Message(models.Model):
     """
@@ -26,6 +68,26 @@ class Message(models.Model):
     )
     
     user = models.ForeignKey("users.User", on_delete=models.CASCADE, blank=True, null=True)
+    session_id = models.CharField(max_length=64, blank=True, null=True)
     role = models.CharField(max_length=10, choices=ROLE_CHOICES)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True) 
\ No newline at end of file
+    timestamp = models.DateTimeField(auto_now_add=True) 
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "timestamp"]),
+            models.Index(fields=["session_id", "timestamp"]),
+        ]
+
+
+class FaceIdentity(models.Model):
+    """
+    Stores enrolled face encodings, loaded into the face index at startup
+    """
+    identity_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    user = models.ForeignKey("users.User", on_delete=models.SET_NULL, blank=True, null=True)
+    encoding = models.BinaryField() # 128 float32 values
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.identity_id}"
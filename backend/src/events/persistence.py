@@ -0,0 +1,208 @@
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+
+from events.metrics import metrics, stage_duration
+from events.models import Event
+from events.storage import storage_policy
+from events.streams import defers_ack, take_ack
+
+import threading
+import atexit
+import queue
+import time
+
+
+class EventWriter:
+    """
+    Buffered writer for the event log.
+
+    event.save messages are queued and a background thread writes them in batches
+    with ``bulk_create`` once ``batch_size`` events are buffered or ``flush_interval``
+    seconds have passed since the first one. The queue is bounded: when Postgres
+    can't keep up, ``add`` blocks the caller for up to ``put_timeout`` seconds before
+    dropping the event. Pending events are flushed on interpreter shutdown.
+
+    Events are stored according to ``storage_policy``: skipped or sampled event types
+    never enter the buffer, large binary fields are moved to the blob store by the
+    writer thread.
+
+    In streams mode an event's stream entry is acknowledged once the event is written,
+    or dropped.
+    """
+
+    def __init__(self, batch_size=200, flush_interval=1.0, max_pending=5000, put_timeout=5.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.stopping = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+        # Counters
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    @defers_ack
+    def add(self, params):
+        """Queue an event for writing, blocking while the buffer is full."""
+        ack = take_ack(params)
+        if not storage_policy.should_store(params.get("type")):
+            ack.done()
+            return
+
+        # Replayed traffic is already in the log, see the replay_events command
+        if (params.get("metadata") or {}).get("replay"):
+            ack.done()
+            return
+
+        try:
+            self.queue.put((params, ack), timeout=self.put_timeout)
+        except queue.Full:
+            ack.done()
+            with self.lock:
+                self.dropped += 1
+            print(f"Event writer buffer full, dropped {params.get('type')} event")
+
+    def _build(self, params):
+        return Event(
+            event_type=params.get("type"),
+            timestamp=params.get("timestamp") or timezone.now(),
+            data=storage_policy.offload(params.get("type"), params.get("payload")),
+            metadata=params.get("metadata"),
+            session_id=(params.get("metadata") or {}).get("session_id"),
+        )
+
+    def _fail(self, count, error):
+        with self.lock:
+            self.failed += count
+        print(f"Failed to write {count} events: {error}")
+
+    def _write(self, batch):
+        """Write a batch of queued (event, acknowledgement) pairs, then acknowledge them."""
+        self._insert([params for params, ack in batch])
+        for params, ack in batch:
+            ack.done()
+
+    def _insert(self, batch):
+        """
+        Write a batch of events in one INSERT per ``batch_size`` rows.
+
+        Events that can't be built are skipped, and when the database rejects the batch it
+        is retried row by row, so one bad event never loses the others.
+        """
+        close_old_connections()
+
+        events = []
+        for params in batch:
+            try:
+                events.append(self._build(params))
+            except Exception as e:
+                self._fail(1, f"{params.get('type')} event: {e}")
+        if not events:
+            return
+
+        try:
+            with stage_duration.time(stage="db_save"):
+                Event.objects.bulk_create(events, batch_size=self.batch_size)
+        except DatabaseError as e:
+            if len(events) == 1:
+                self._fail(1, e)
+                return
+            print(f"Failed to write a batch of {len(events)} events, retrying one by one: {e}")
+            for event in events:
+                try:
+                    event.save()
+                except DatabaseError as e:
+                    self._fail(1, f"{event.event_type} event: {e}")
+                else:
+                    with self.lock:
+                        self.written += 1
+            return
+
+        with self.lock:
+            self.written += len(events)
+
+    def _next_batch(self):
+        """Collect events until the batch is full or the flush interval has passed."""
+        batch = []
+        deadline = None
+
+        while len(batch) < self.batch_size:
+            timeout = self.flush_interval if deadline is None else deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                if deadline is not None or self.stopping.is_set():
+                    break
+                continue
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+
+        return batch
+
+    def _run(self):
+        while not (self.stopping.is_set() and self.queue.empty()):
+            try:
+                batch = self._next_batch()
+                if batch:
+                    self._write(batch)
+            except Exception as e:
+                # The writer thread must survive anything, or every later event is dropped
+                print(f"Event writer error: {e}")
+                time.sleep(self.flush_interval)
+
+    def flush(self):
+        """Synchronously write everything that is currently queued."""
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        for i in range(0, len(batch), self.batch_size):
+            self._write(batch[i:i + self.batch_size])
+
+    def start(self):
+        """Start the writer thread and flush pending events on shutdown."""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name="event-writer")
+            self.thread.daemon = True
+            self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=10):
+        """Stop the writer thread after it has written every queued event."""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout=timeout)
+        self.flush()
+
+    def stats(self):
+        """Counters and current buffer size."""
+        with self.lock:
+            return {
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "pending": self.queue.qsize(),
+            }
+
+
+event_writer = EventWriter(
+    batch_size=settings.EVENT_WRITER_BATCH_SIZE,
+    flush_interval=settings.EVENT_WRITER_FLUSH_INTERVAL,
+    max_pending=settings.EVENT_WRITER_MAX_PENDING,
+    put_timeout=settings.EVENT_WRITER_PUT_TIMEOUT,
+)
+
+metrics.gauge("event_writer_pending", "Events waiting to be written", lambda: event_writer.stats()["pending"])
+metrics.gauge("event_writer_events", "Events written, dropped or failed by the event writer", lambda: {
+    (("state", state),): value for state, value in event_writer.stats().items() if state != "pending"
+})
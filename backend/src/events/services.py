@@ -1,56 +1,49 @@
 from django.conf import settings
+from django.utils.functional import SimpleLazyObject, empty
 
-from .utils import base64_to_frame
+from .audio import AudioSegmenter
+from .detection import FaceDetectionStage, FaceDetector
+from .face_index import face_index
+from .metrics import stage_duration
+from .speech import get_speech_backend
+from .utils import Frame
 
-from fer import FER
-from openai import OpenAI
-import face_recognition
-import speech_recognition as sr
-
-import cv2
+import time
 
 
 class AudioTranscriptionService:
     """
     A service class for transcribing audio to text using speech recognition.
 
-    This class uses the SpeechRecognition library and the Google Web Speech API to transcribe
-    audio data into text. The language for transcription can be customized during initialization.
-    By default, the class uses Dutch ("nl-NL") as the transcription language.
+    This class delegates transcription to a speech backend, which is created once and reused for
+    every request. Available backends are the Google Web Speech API ("google") and a local,
+    CPU-only Vosk model ("vosk") that works without network access. The language for
+    transcription can be customized, by default Dutch ("nl-NL") is used.
 
     Attributes:
         language (str): The language to be used for transcription. Defaults to "nl-NL".
-        recognizer (Recognizer): The SpeechRecognition recognizer instance used for processing audio.
+        backend (SpeechBackend): The speech-to-text engine used for processing audio.
     """
         
-    def __init__(self, language="nl-NL"):
-        self.recognizer = sr.Recognizer()
+    def __init__(self, backend="google", language="nl-NL", **options):
         self.language = language
+        self.backend = get_speech_backend(backend, language=language, **options)
 
-    def transcribe_audio(self, audio_bytes, sample_rate=44100, sample_width=2):
+    def transcribe_audio(self, audio_bytes, sample_rate=44100, sample_width=2, channels=1):
         """
         Transcribes the given audio bytes to text.
 
-        This method accepts raw audio bytes, converts them to an AudioData object, and uses the
-        Google Web Speech API to transcribe the audio to text.
-
         Args:
-            audio_bytes (bytes): The raw audio data in bytes format, typically in WAV format.
+            audio_bytes (bytes): The raw PCM audio data in bytes format.
             sample_rate (int): The sample rate of the audio (default is 44100 Hz).
             sample_width (int): The sample width of the audio (default is 2 bytes).
+            channels (int): The number of interleaved channels (default is 1).
 
         Returns:
             str or None: The transcribed text if successful, None if transcription fails.
         """
-        audio_data = sr.AudioData(audio_bytes, sample_rate, sample_width)
-        
-        try:
-            transcription = self.recognizer.recognize_google(audio_data, language=self.language)
-            return transcription
-        except sr.UnknownValueError:
-            return None
-        except sr.RequestError as e:
-            return None
+        with stage_duration.time(stage="stt"):
+            return self.backend.transcribe(audio_bytes, sample_rate, sample_width, channels)
 
 
 class LLMService:
@@ -63,26 +56,50 @@ class LLMService:
 
     Methods:
         - generate_text: Generate text based on a given prompt.
+        - stream_text: Generate text based on a given prompt, yielding it as it arrives.
     """
 
-    def __init__(self, api_key=settings.OPENAI_API_KEY, model_name="gpt-3.5-turbo"):
+    def __init__(self, api_key=settings.OPENAI_API_KEY, model_name=settings.LLM_MODEL, base_url=settings.LLM_BASE_URL):
         """
         Initialize the LLM service with API key and model name.
         
         Parameters:
             api_key (str): API key for accessing the LLM service (e.g., OpenAI).
             model_name (str): The model to be used (default is GPT-3.5).
+            base_url (str): URL of an OpenAI-compatible endpoint, None for OpenAI itself.
         """
         self.api_key = api_key
         self.model_name = model_name
-        self.client = OpenAI(api_key=self.api_key)
+        from openai import OpenAI
+        self.client = OpenAI(api_key=self.api_key, base_url=base_url or None)
         self.instruction = """You are a Virtual Human called Janine designed to provide empathetic and supportive interactions.\nYour primary goal is to understand the user's emotions and respond with care, validation, and encouragement.\n\nKey Principles:\n1. Acknowledge Emotions: Always recognize and validate the user's feelings based on their input.\n2. Express Understanding: Use language that shows you understand or are trying to understand their perspective.\n3. Provide Support: Offer words of encouragement, reassurance, or actionable suggestions, depending on the context.\n4. Adapt to Tone: Match the user's tone and emotional state to build a connection. If they are joyful, celebrate with them; if they are upset, respond with calm and compassion.\n5. Avoid Over-Automation: Ensure your responses feel human, warm, and natural.\n\nExamples of empathetic phrases to use:\n- 'It sounds like you're feeling...'\n- 'That must be really challenging.'\n- 'I'm here to help in any way I can.'\n- 'It's wonderful to hear that!'\n- 'Thank you for sharing that with me.'\n\nExample Scenarios:\n1. If the user shares something positive: Celebrate with them and express genuine excitement.\nExample: 'That's amazing! I'm so happy for you—congratulations on this achievement!'\n2. If the user shares something negative: Validate their feelings and offer support.\nExample: 'I'm really sorry you're going through this. That sounds really tough. If you’d like to talk more about it, I’m here to listen.'\n3. If the user is seeking advice: Be constructive and kind, focusing on encouragement.\nExample: 'I understand this can feel overwhelming, but you've got this. Let’s break it down together.'\n\n# Avoid overly formal language or responses that seem dismissive or generic. Always aim to create a safe and supportive space for the user."""
     
-    def build_context(self, messages):
+    def build_context(self, messages, summary=None):
+        """
+        Build chat context and append system context, and the summary of earlier messages if any.
         """
-        Build chat context and append system context.
+        context = [{"role": "system", "content": self.instruction}]
+        if summary:
+            context.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+        return context + [{"role": message.role, "content": message.content} for message in messages]
+
+    def summarize(self, messages, summary=None, max_tokens=300):
+        """
+        Fold messages into a rolling summary of the conversation.
+
+        Parameters:
+            messages (list): The messages to add to the summary.
+            summary (str): The summary of the messages before them, if any.
+
+        Returns:
+            str: The updated summary.
         """
-        return [{"role": "system", "content": self.instruction}] + [{"role": message.role, "content": message.content} for message in messages]
+        transcript = "\n".join(f"{message.role}: {message.content}" for message in messages)
+        context = [
+            {"role": "system", "content": "Summarize the conversation below in a few sentences. Keep facts about the user, their feelings and open questions."},
+            {"role": "user", "content": f"{f'Earlier summary: {summary}' if summary else ''}\n{transcript}".strip()},
+        ]
+        return self.generate_text(context=context, max_tokens=max_tokens, temperature=0.2)
 
     def generate_text(self, context, max_tokens=1000, temperature=0.7):
         """
@@ -97,16 +114,51 @@ class LLMService:
             str: The generated response from the LLM.
         """
         try:
-            completion = self.client.chat.completions.create(
+            with stage_duration.time(stage="llm"):
+                completion = self.client.chat.completions.create(
+                    model=self.model_name,
+                    messages=context,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                )
+
+            return completion.choices[0].message.content
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    def stream_text(self, context, max_tokens=1000, temperature=0.7):
+        """
+        Generate text from a given prompt using the LLM, streaming the response.
+
+        Parameters:
+            context (list): The chat messages to send to the LLM.
+            max_tokens (int): Maximum number of tokens for the response.
+            temperature (float): Controls randomness (higher = more creative).
+
+        Yields:
+            str: Pieces of the generated response as soon as the LLM produces them.
+        """
+        start = time.perf_counter()
+        first_token = True
+        try:
+            stream = self.client.chat.completions.create(
                 model=self.model_name,
                 messages=context,
                 max_tokens=max_tokens,
                 temperature=temperature,
+                stream=True,
             )
 
-            return completion.choices[0].message.content
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first_token:
+                        stage_duration.observe(time.perf_counter() - start, stage="llm_first_token")
+                        first_token = False
+                    yield chunk.choices[0].delta.content
+
+            stage_duration.observe(time.perf_counter() - start, stage="llm")
         except Exception as e:
-            return f"Error: {str(e)}"
+            yield f"Error: {str(e)}"
 
 
 class FaceRecognitionService:
@@ -114,49 +166,88 @@ class FaceRecognitionService:
     Service for processing image frames to detect and recognize faces using facial recognition.
     
     This service processes each incoming frame to identify faces and match them with known 
-    encodings. It maintains a list of known face encodings to avoid redundant database queries 
-    and to optimize performance by reducing unnecessary load times. The service can detect both 
-    recognized and unrecognized faces.
+    encodings. Known encodings are kept in a face index loaded from the database once, so 
+    matching a face is a single vectorized nearest-neighbour lookup instead of a database query. 
+    Unrecognized faces can be enrolled in the index as new identities.
+
+    Faces are found by the shared face detection stage. When it tracks faces, a face is only 
+    encoded again when its track is new or its recognition result is older than the refresh 
+    interval.
 
     Methods:
-        - detect_and_recognize_faces: Analyze emotions in a provided image.
+        - detect_and_recognize_faces: Detect faces in a provided image and match them to known faces.
     """
 
-    def __init__(self, face_locations_model="hog", face_encodings_model="small", number_of_times_to_upsample=1, tolerance=0.5):
-        self.tolerance = tolerance
-        self.face_locations_model = face_locations_model 
+    def __init__(self, detection, face_encodings_model="small", index=None, enroll_unrecognized=False, refresh_interval=5.0):
+        self.detection = detection
         self.face_encodings_model = face_encodings_model
-        self.number_of_times_to_upsample = number_of_times_to_upsample
+        self.index = index or face_index
+        self.enroll_unrecognized = enroll_unrecognized
+        self.refresh_interval = refresh_interval
+
+    def _recognize(self, rgb_frame, face_locations):
+        """
+        Encode faces and match them against the face index.
+
+        Returns:
+            list: (recognized, face) per location.
+        """
+        import face_recognition
 
-        # TODO: Fetch existing from database 
-        self.known_face_encodings = []
+        with stage_duration.time(stage="face_encoding"):
+            face_encodings = face_recognition.face_encodings(
+                rgb_frame, face_locations, model=self.face_encodings_model
+            )
 
-    def detect_and_recognize_faces(self, base64_string: str):
+        faces = []
+        matches = self.index.search(face_encodings)
+        for location, face_encoding, (identity_id, distance) in zip(face_locations, face_encodings, matches):
+            if identity_id is not None:
+                faces.append((True, {
+                    "id": identity_id,
+                    "distance": distance,
+                    "location": list(location),
+                }))
+            else:
+                faces.append((False, {
+                    "id": self.index.enroll(face_encoding) if self.enroll_unrecognized else None,
+                    "encoding": face_encoding.tolist(),
+                    "location": list(location),
+                }))
+        return faces
+
+    def detect_and_recognize_faces(self, frame: Frame, session_id=None):
         """
         Process image frame to detect and recognize faces.
+
+        Returns:
+            tuple: (recognized faces, unrecognized faces). Recognized faces hold the ``id`` of
+            the nearest enrolled identity and its ``distance``, unrecognized faces hold their
+            ``encoding`` and, when enrolled, their new ``id``. Both hold the face ``location``
+            as (top, right, bottom, left) in original image coordinates, and its ``track_id``
+            when faces are tracked.
         """
-        frame = base64_to_frame(base64_string)
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        face_locations = face_recognition.face_locations(
-            rgb_frame, number_of_times_to_upsample=self.number_of_times_to_upsample, model=self.face_locations_model
-        )
-        face_encodings = face_recognition.face_encodings(
-            rgb_frame, face_locations, model=self.face_encodings_model
-        )
+        detected = self.detection.detect(frame, session_id=session_id)
+
+        # Only encode faces without a fresh recognition result on their track
+        stale = [i for i, (box, track) in enumerate(detected) if track is None or not track.is_fresh(self.refresh_interval)]
+        encoded = dict(zip(stale, self._recognize(frame.rgb, [detected[i][0] for i in stale]))) if stale else {}
 
         recognized_faces = []
         unrecognized_faces = []
 
-        for face_encoding in face_encodings:
-            matches = face_recognition.compare_faces(
-                self.known_face_encodings, face_encoding, tolerance=self.tolerance
-            )
-            if True in matches:
-                match_index = matches.index(True)
-                recognized_face = self.known_face_encodings[match_index]
-                recognized_faces.append(recognized_face)
+        for i, (box, track) in enumerate(detected):
+            if i in encoded:
+                recognized, face = encoded[i]
+                if track is not None:
+                    track.remember(recognized, face)
             else:
-                unrecognized_faces.append(face_encoding)
+                recognized, face = track.recognized, track.face
+
+            face = {**face, "location": [value * frame.scale for value in box]}
+            if track is not None:
+                face["track_id"] = track.id
+            (recognized_faces if recognized else unrecognized_faces).append(face)
 
         return recognized_faces, unrecognized_faces
     
@@ -165,27 +256,91 @@ class EmotionService:
     """
     Service for emotion recognition using FER (Facial Expression Recognition).
 
-    This service processes base64-encoded image data to analyze facial emotions. 
-    It uses the FER library with MTCNN for detecting faces and evaluating 
-    emotions including angry, disgust, fear, happy, neutral, sad, suprise.
+    This service processes decoded image frames to analyze facial emotions. 
+    Faces are found by the shared face detection stage and FER evaluates 
+    emotions including angry, disgust, fear, happy, neutral, sad, suprise on those faces.
 
     Methods:
         - detect_emotions: Analyze emotions in a provided image.
     """
 
-    def __init__(self):
-        """Initialize the FER detector."""
-        self.detector = FER(mtcnn=True)
+    def __init__(self, detection):
+        """Initialize the FER classifier, face detection is done by the shared detection stage."""
+        self.detection = detection
+        from fer import FER
+        self.detector = FER(mtcnn=False)
     
-    def detect_emotions(self, base64_string: str):
+    def detect_emotions(self, frame: Frame, session_id=None):
         """
         Detect emotions
         """
-        frame = base64_to_frame(base64_string)
-        emotions = self.detector.detect_emotions(frame)
+        face_rectangles = [
+            (left, top, right - left, bottom - top)
+            for (top, right, bottom, left), track in self.detection.detect(frame, session_id=session_id)
+        ]
+        if not face_rectangles:
+            return {}
+
+        image = frame.bgr
+        with stage_duration.time(stage="fer"):
+            emotions = self.detector.detect_emotions(image, face_rectangles=face_rectangles)
         return emotions[0].get("emotions") if len(emotions) > 0 else {}
     
 
-emotion_service = EmotionService()
-face_recognition_service = FaceRecognitionService()
-llm_service = LLMService()
\ No newline at end of file
+# Services are built on first use, so processes only load the models of the handlers they run
+face_detection = SimpleLazyObject(lambda: FaceDetectionStage(
+    detector=FaceDetector(
+        model=settings.FACE_DETECTION_MODEL,
+        number_of_times_to_upsample=settings.FACE_DETECTION_UPSAMPLE,
+        max_width=settings.FACE_DETECTION_MAX_WIDTH,
+    ),
+    tracking=settings.FACE_TRACKING,
+    tracker_options={
+        "keyframe_interval": settings.FACE_TRACKING_KEYFRAME_INTERVAL,
+        "min_score": settings.FACE_TRACKING_MIN_SCORE,
+    },
+))
+audio_transcription_service = SimpleLazyObject(lambda: AudioTranscriptionService(
+    backend=settings.SPEECH_BACKEND,
+    language=settings.SPEECH_LANGUAGE,
+    **settings.SPEECH_BACKEND_OPTIONS,
+))
+audio_segmenter = SimpleLazyObject(lambda: AudioSegmenter(
+    backend=audio_transcription_service.backend,
+    vad=settings.AUDIO_VAD,
+    vad_options=settings.AUDIO_VAD_OPTIONS,
+    sample_rate=settings.AUDIO_SAMPLE_RATE,
+    start_ms=settings.AUDIO_VAD_START_MS,
+    end_ms=settings.AUDIO_VAD_END_MS,
+    pre_roll_ms=settings.AUDIO_PRE_ROLL_MS,
+    max_seconds=settings.AUDIO_MAX_UTTERANCE_SECONDS,
+))
+emotion_service = SimpleLazyObject(lambda: EmotionService(detection=face_detection))
+face_recognition_service = SimpleLazyObject(lambda: FaceRecognitionService(
+    detection=face_detection,
+    enroll_unrecognized=settings.FACE_INDEX_AUTO_ENROLL,
+    refresh_interval=settings.FACE_TRACKING_REFRESH_INTERVAL,
+))
+llm_service = SimpleLazyObject(lambda: LLMService())
+
+# The services each process role uses
+ROLE_SERVICES = {
+    "vision": (face_detection, emotion_service, face_recognition_service),
+    "speech": (audio_transcription_service, audio_segmenter, llm_service),
+}
+
+
+def warm_up(roles):
+    """
+    Build the services of the given roles now, instead of on the first event.
+
+    Parameters:
+        roles (list): Process roles, see ``settings.EVENTS_ROLES``.
+    """
+    for role in roles:
+        for service in ROLE_SERVICES.get(role, ()):
+            if service._wrapped is empty:
+                service._setup()
+
+    if "vision" in roles:
+        face_recognition_service.index.load()
@@ -0,0 +1,109 @@
+from django.conf import settings
+
+from events.metrics import metrics
+
+import threading
+import time
+
+
+emotions_suppressed = metrics.counter(
+    "face_emotion_suppressed_total", "Emotion results not published because they barely changed"
+)
+
+
+class SessionEmotions:
+    """Smoothed emotion scores of one session and what was last published."""
+
+    def __init__(self):
+        self.scores = None
+        self.published = None
+        self.published_at = None
+
+
+def dominant(scores):
+    return max(scores, key=scores.get) if scores else None
+
+
+class EmotionSmoother:
+    """
+    Temporal smoothing and change-driven publishing of face emotions.
+
+    FER scores of a session are smoothed with an exponential moving average,
+    ``alpha`` being the weight of the newest frame (1 disables smoothing). A result
+    is only published when the dominant emotion changes, a face appears or is lost,
+    any score moved by ``threshold`` or more since the last published result, or
+    ``heartbeat`` seconds have passed since it (0 disables the heartbeat).
+
+    The state of a session lives in the process that handles its frames, which the
+    vision process pool guarantees by routing events by session.
+    """
+
+    def __init__(self, alpha=0.3, threshold=0.15, heartbeat=5.0):
+        self.alpha = alpha
+        self.threshold = threshold
+        self.heartbeat = heartbeat
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def _smooth(self, previous, emotions):
+        if not emotions:
+            return None
+        if not previous:
+            return dict(emotions)
+        return {
+            emotion: self.alpha * score + (1 - self.alpha) * previous.get(emotion, score)
+            for emotion, score in emotions.items()
+        }
+
+    def _changed(self, state, now):
+        if state.published_at is None:
+            return True
+        if self.heartbeat and now - state.published_at >= self.heartbeat:
+            return True
+        if dominant(state.scores) != dominant(state.published):
+            return True
+        if not state.scores:
+            return False
+        return any(
+            abs(score - state.published.get(emotion, 0)) >= self.threshold
+            for emotion, score in state.scores.items()
+        )
+
+    def update(self, session_id, emotions):
+        """
+        Add the emotions detected in a frame.
+
+        Parameters:
+            session_id (str): The session of the frame.
+            emotions (dict): FER scores per emotion, empty when no face was found.
+
+        Returns:
+            dict: The smoothed scores to publish, empty when the face was lost, or None
+            when nothing should be published.
+        """
+        now = time.monotonic()
+        with self.lock:
+            state = self.sessions.get(session_id)
+            if state is None:
+                state = self.sessions[session_id] = SessionEmotions()
+
+            state.scores = self._smooth(state.scores, emotions)
+            if not self._changed(state, now):
+                emotions_suppressed.inc()
+                return None
+
+            state.published = state.scores
+            state.published_at = now
+            return {emotion: round(score, 4) for emotion, score in (state.scores or {}).items()}
+
+    def forget(self, params):
+        """Drop the state of a session that disconnected, subscribed to session.closed."""
+        with self.lock:
+            self.sessions.pop((params.get("metadata") or {}).get("session_id"), None)
+
+
+emotion_smoother = EmotionSmoother(
+    alpha=settings.EMOTION_SMOOTHING_ALPHA,
+    threshold=settings.EMOTION_PUBLISH_THRESHOLD,
+    heartbeat=settings.EMOTION_HEARTBEAT_INTERVAL,
+)
@@ -0,0 +1,162 @@
+from .utils import pcm_to_mono16
+
+import speech_recognition as sr
+import json
+import time
+
+
+class SpeechBackend:
+    """
+    Interface of the speech-to-text engines used by ``AudioTranscriptionService``.
+
+    Backends are created once and reused for every request, so expensive set-up such
+    as loading a model belongs in ``__init__``.
+
+    Backends that can decode audio while it is still being recorded set
+    ``supports_streaming`` and return a ``SpeechStream`` from ``stream``.
+
+    Methods:
+        - transcribe: Transcribe a complete utterance of raw PCM audio.
+        - stream: Start the incremental transcription of an utterance.
+    """
+
+    supports_streaming = False
+
+    def transcribe(self, audio_bytes, sample_rate, sample_width, channels=1):
+        """
+        Transcribe raw PCM audio.
+
+        Returns:
+            str or None: The transcription, None when no speech was recognized.
+        """
+        raise NotImplementedError
+
+    def stream(self, sample_rate):
+        """Start transcribing an utterance of 16-bit mono PCM audio fed in pieces."""
+        raise NotImplementedError
+
+
+class SpeechStream:
+    """
+    Incremental transcription of one utterance.
+
+    Methods:
+        - accept: Feed the next piece of audio, returns the partial transcription so far.
+        - finish: End the utterance, returns the final transcription or None.
+    """
+
+    def accept(self, audio_bytes):
+        raise NotImplementedError
+
+    def finish(self):
+        raise NotImplementedError
+
+
+class GoogleSpeechBackend(SpeechBackend):
+    """
+    Transcribes audio with the Google Web Speech API through SpeechRecognition.
+
+    Requires network access, every request is a round trip to Google.
+    """
+
+    def __init__(self, language="nl-NL"):
+        self.recognizer = sr.Recognizer()
+        self.language = language
+
+    def transcribe(self, audio_bytes, sample_rate, sample_width, channels=1):
+        if channels > 1:
+            audio_bytes, sample_width = pcm_to_mono16(audio_bytes, sample_width, channels), 2
+        audio_data = sr.AudioData(audio_bytes, sample_rate, sample_width)
+
+        try:
+            return self.recognizer.recognize_google(audio_data, language=self.language)
+        except sr.UnknownValueError:
+            return None
+        except sr.RequestError as e:
+            print(f"Google speech recognition request failed: {e}")
+            return None
+
+
+class VoskSpeechBackend(SpeechBackend):
+    """
+    Transcribes audio locally on the CPU with a Vosk (Kaldi) model.
+
+    The model is loaded once, each request only creates a lightweight recognizer. The
+    language is determined by the model, e.g. ``vosk-model-small-nl-0.22`` for Dutch.
+    """
+
+    supports_streaming = True
+
+    def __init__(self, model_path, language=None):
+        from vosk import Model, SetLogLevel
+
+        SetLogLevel(-1)
+        self.model = Model(model_path)
+        self.language = language
+
+    def recognizer(self, sample_rate):
+        from vosk import KaldiRecognizer
+        return KaldiRecognizer(self.model, sample_rate)
+
+    def transcribe(self, audio_bytes, sample_rate, sample_width, channels=1):
+        recognizer = self.recognizer(sample_rate)
+        recognizer.AcceptWaveform(pcm_to_mono16(audio_bytes, sample_width, channels))
+        return json.loads(recognizer.FinalResult()).get("text") or None
+
+    def stream(self, sample_rate):
+        return VoskSpeechStream(self.recognizer(sample_rate))
+
+
+class VoskSpeechStream(SpeechStream):
+    """
+    Feeds an utterance to a Vosk recognizer as it arrives.
+
+    Vosk finalizes a segment whenever it detects a pause of its own, the segments
+    are joined so the partial and final transcriptions cover the whole utterance.
+    """
+
+    def __init__(self, recognizer):
+        self.recognizer = recognizer
+        self.segments = []
+
+    def _text(self, last):
+        return " ".join(segment for segment in self.segments + [last] if segment) or None
+
+    def accept(self, audio_bytes):
+        if self.recognizer.AcceptWaveform(bytes(audio_bytes)):
+            self.segments.append(json.loads(self.recognizer.Result()).get("text"))
+            return self._text(None)
+        return self._text(json.loads(self.recognizer.PartialResult()).get("partial"))
+
+    def finish(self):
+        return self._text(json.loads(self.recognizer.FinalResult()).get("text"))
+
+
+class StubSpeechBackend(SpeechBackend):
+    """
+    Returns a fixed transcription after a fixed delay, a stand-in for benchmarks and
+    local development without network access or models.
+    """
+
+    def __init__(self, text="Hallo, hoe gaat het met je?", delay=0.3, language=None):
+        self.text = text
+        self.delay = delay
+        self.language = language
+
+    def transcribe(self, audio_bytes, sample_rate, sample_width, channels=1):
+        time.sleep(self.delay)
+        return self.text
+
+
+SPEECH_BACKENDS = {
+    "google": GoogleSpeechBackend,
+    "vosk": VoskSpeechBackend,
+    "stub": StubSpeechBackend,
+}
+
+
+def get_speech_backend(name, **options):
+    """Create the speech backend registered under ``name``."""
+    if name not in SPEECH_BACKENDS:
+        raise ValueError(f"Unknown speech backend {name}")
+    return SPEECH_BACKENDS[name](**options)
@@ -0,0 +1,130 @@
+from django.conf import settings
+
+from events.event_bus import event_bus
+
+from pathlib import Path
+import threading
+import hashlib
+import base64
+import os
+
+
+BLOB_KEY = "$blob"
+
+
+class BlobStore:
+    """
+    Content-addressed file store for large event payload fields.
+
+    Blobs are stored under ``root`` by their SHA-256 digest (``ab/cd/abcd...``), so
+    identical content is only stored once. References look like ``sha256:<digest>``.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def _path(self, digest):
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    def put(self, data: bytes):
+        """Store bytes and return their reference."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{digest}.{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+
+        return f"sha256:{digest}"
+
+    def get(self, ref: str):
+        """Read the bytes of a reference returned by ``put``."""
+        algorithm, _, digest = ref.partition(":")
+        if algorithm != "sha256" or not digest:
+            raise ValueError(f"Invalid blob reference {ref}")
+        return self._path(digest).read_bytes()
+
+
+class EventStoragePolicy:
+    """
+    Decides how each event type is stored in the event log.
+
+    ``policies`` maps event types to options:
+        - skip (bool): don't store events of this type at all.
+        - sample_every (int): only store every Nth event of this type.
+        - blobs (list): payload fields moved to the blob store when they are larger than
+          ``min_blob_size`` bytes. Base64 strings are stored decoded, raw bytes (binary
+          event bus codecs) are always moved. Payloads of binary WebSocket messages with a
+          ``blob`` key on the event bus are stored under the first listed field.
+
+    Offloaded fields are replaced by ``{"$blob": "<ref>", "size": <bytes>}``,
+    ``resolve`` turns them back into base64 strings.
+    """
+
+    def __init__(self, store, policies, min_blob_size=1024):
+        self.store = store
+        self.policies = policies
+        self.min_blob_size = min_blob_size
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def should_store(self, event_type):
+        """Whether an event of this type should be written, applies skipping and sampling."""
+        policy = self.policies.get(event_type, {})
+        if policy.get("skip"):
+            return False
+
+        sample_every = policy.get("sample_every", 1)
+        if sample_every <= 1:
+            return True
+
+        with self.lock:
+            count = self.counts.get(event_type, 0)
+            self.counts[event_type] = count + 1
+        return count % sample_every == 0
+
+    def _offload(self, data: bytes):
+        return {BLOB_KEY: self.store.put(data), "size": len(data)}
+
+    def offload(self, event_type, payload):
+        """Move the large binary fields of a payload to the blob store."""
+        fields = self.policies.get(event_type, {}).get("blobs")
+        if not fields or not isinstance(payload, dict):
+            return payload
+
+        payload = dict(payload)
+
+        if payload.get("blob"):
+            data = event_bus.get_blob(payload.pop("blob"))
+            if data is not None:
+                payload[fields[0]] = self._offload(data)
+
+        for field in fields:
+            value = payload.get(field)
+            if isinstance(value, (bytes, bytearray)):
+                payload[field] = self._offload(bytes(value))
+            elif isinstance(value, str) and len(value) > self.min_blob_size:
+                payload[field] = self._offload(base64.b64decode(value))
+
+        return payload
+
+    def resolve(self, payload):
+        """Replace blob references in a stored payload by their base64-encoded content."""
+        if not isinstance(payload, dict):
+            return payload
+
+        resolved = dict(payload)
+        for field, value in payload.items():
+            if isinstance(value, dict) and BLOB_KEY in value:
+                resolved[field] = base64.b64encode(self.store.get(value[BLOB_KEY])).decode()
+        return resolved
+
+
+blob_store = BlobStore(Path(settings.MEDIA_ROOT) / "events")
+storage_policy = EventStoragePolicy(
+    store=blob_store,
+    policies=settings.EVENT_STORAGE_POLICIES,
+    min_blob_size=settings.EVENT_BLOB_MIN_SIZE,
+)
@@ -0,0 +1,281 @@
+from django.conf import settings
+
+import redis.asyncio as aioredis
+import redis
+import threading
+import asyncio
+import socket
+import math
+import time
+import zlib
+import os
+
+
+# Key of the stream entry acknowledgement in events given to handlers that defer it
+ACK_KEY = "_ack"
+
+
+def defers_ack(handler):
+    """
+    Declare that a handler only queues events for later work.
+
+    In streams mode the event it receives carries the acknowledgement of its stream
+    entry, which the handler removes with ``take_ack`` and releases once the work is
+    done, so entries are not acknowledged while the work is still queued in memory.
+    """
+    handler.defers_ack = True
+    return handler
+
+
+class Acknowledgement:
+    """Acknowledges a stream entry once every hold on it is released, from any thread."""
+
+    def __init__(self, transport, key, entry_id):
+        self.transport = transport
+        self.key = key
+        self.entry_id = entry_id
+        self.holds = 1
+        self.lock = threading.Lock()
+
+    def hold(self):
+        with self.lock:
+            self.holds += 1
+        return self
+
+    def done(self):
+        with self.lock:
+            self.holds -= 1
+            if self.holds:
+                return
+        self.transport.bus.loop.call_soon_threadsafe(self.transport.acknowledge, self.key, self.entry_id)
+
+
+class _NoAcknowledgement:
+    """Stands in for the acknowledgement of events that didn't come from a stream."""
+
+    def done(self):
+        pass
+
+
+NO_ACK = _NoAcknowledgement()
+
+
+def take_ack(params):
+    """Remove the acknowledgement from an event given to a ``defers_ack`` handler."""
+    return params.pop(ACK_KEY, None) or NO_ACK
+
+
+class StreamTransport:
+    """
+    Redis Streams transport of the event bus, used with ``EVENT_BUS_MODE = "streams"``.
+
+    Every event type in ``policies`` is appended to its own stream (``stream:<event>``)
+    and read through one consumer group shared by all
+    processes, so each event is handled by exactly one process and events published
+    while no process is listening wait in the stream. Entries are acknowledged once
+    all handlers finished, or for handlers that queue the work (``defers_ack``) once
+    the queued work is done. Entries of a process that died are reclaimed by another
+    after ``claim_idle_ms``.
+
+    Events with per-session state in the handling process (``affinity_events``) are
+    spread over ``partitions`` streams by session, and every partition is leased to
+    one process at a time, so all events of a session reach the same process. The
+    partitions of each event are shared evenly between the live processes that listen
+    to it, so processes of different roles never hold each other's partitions.
+
+    ``policies`` maps the queued event types to their retention: streams are trimmed
+    to about ``maxlen`` entries (per partition), or to the last ``max_age`` seconds,
+    and with ``delete`` entries are deleted once acknowledged, so large payloads such
+    as video frames don't stay in Redis after they were handled. Event types without
+    a policy have no stream consumer or must reach every process (``session.closed``),
+    they are published over pub/sub.
+    """
+
+    def __init__(self, bus, group="handlers", maxlen=10000, batch_size=32, block_ms=1000, claim_idle_ms=60000,
+                 prefetch=64, partitions=16, lease_ttl_ms=10000, affinity_events=(), policies=None):
+        self.bus = bus
+        self.group = group
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self.maxlen = maxlen
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.prefetch = prefetch
+        self.partitions = partitions
+        self.lease_ttl_ms = lease_ttl_ms
+        self.affinity_events = frozenset(affinity_events)
+        self.policies = policies or {}
+
+        self.events = set()
+        self.keys = {}
+        self.leases = {}
+        self.inflight = 0
+        self.capacity = None
+        self.client = None
+
+    def is_queued(self, event_name):
+        return event_name in self.policies
+
+    def key(self, event_name, data=None):
+        """The stream an event is appended to."""
+        if event_name in self.affinity_events:
+            session = ((data or {}).get("metadata") or {}).get("session_id") or ""
+            return f"stream:{event_name}:{zlib.crc32(session.encode()) % self.partitions}"
+        return f"stream:{event_name}"
+
+    def add(self, pipeline, event_name, message, data):
+        """Queue an encoded event on a (sync or asyncio) Redis pipeline."""
+        policy = self.policies[event_name]
+        if policy.get("max_age"):
+            trim = {"minid": int((time.time() - policy["max_age"]) * 1000)}
+        else:
+            trim = {"maxlen": policy.get("maxlen", self.maxlen)}
+        pipeline.xadd(self.key(event_name, data), {"m": message}, approximate=True, **trim)
+
+    async def _refresh_leases(self):
+        """Renew the partitions this process holds and take its share of the free ones, per affinity event."""
+        now = time.time()
+        leases = {}
+        for event_name in sorted(self.events & self.affinity_events):
+            consumers = f"stream:consumers:{event_name}"
+            await self.client.zadd(consumers, {self.consumer: now})
+            await self.client.zremrangebyscore(consumers, 0, now - self.lease_ttl_ms / 1000)
+            share = math.ceil(self.partitions / max(1, await self.client.zcard(consumers)))
+
+            held = set()
+            for partition in range(self.partitions):
+                key = f"stream:lease:{event_name}:{partition}"
+                owner = await self.client.get(key)
+                if owner == self.consumer.encode():
+                    if len(held) < share:
+                        await self.client.pexpire(key, self.lease_ttl_ms)
+                        held.add(partition)
+                    else:
+                        # Hand partitions above our share over to processes that joined
+                        await self.client.delete(key)
+                elif owner is None and len(held) < share:
+                    if await self.client.set(key, self.consumer, nx=True, px=self.lease_ttl_ms):
+                        held.add(partition)
+            leases[event_name] = held
+
+        self.leases = leases
+
+    async def _streams(self):
+        """
+        The streams to read, creating their consumer group on first use. A new group
+        starts at the beginning of the stream, so events appended before the first
+        process started listening are handled too.
+        """
+        streams = []
+        for event_name in list(self.events):
+            if event_name in self.affinity_events:
+                streams += [
+                    (f"stream:{event_name}:{partition}", event_name)
+                    for partition in sorted(self.leases.get(event_name, ()))
+                ]
+            else:
+                streams.append((f"stream:{event_name}", event_name))
+
+        for key, event_name in streams:
+            if key not in self.keys:
+                try:
+                    await self.client.xgroup_create(key, self.group, id="0", mkstream=True)
+                except redis.ResponseError as e:
+                    if "BUSYGROUP" not in str(e):
+                        raise
+                self.keys[key] = event_name
+        return [key for key, event_name in streams]
+
+    async def _process(self, key, entry_id, fields):
+        event_name = self.keys[key]
+        # Malformed entries are acknowledged and dropped, they would fail on every redelivery
+        data = self.bus._decode(fields.get(b"m"))
+        ack = Acknowledgement(self, key, entry_id)
+        try:
+            if data is not None:
+                self.bus.received(event_name, data)
+                await asyncio.gather(*(
+                    self.bus._run_handler(event_name, handler, data, ack)
+                    for handler in self.bus.subscribers.get(event_name, ())
+                ))
+            ack.done()
+        finally:
+            self.inflight -= 1
+            self.capacity.set()
+
+    def acknowledge(self, key, entry_id):
+        """Acknowledge a handled entry, on the event loop."""
+        self.bus.loop.create_task(self._acknowledge(key, entry_id))
+
+    async def _acknowledge(self, key, entry_id):
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            pipeline.xack(key, self.group, entry_id)
+            if self.policies.get(self.keys[key], {}).get("delete"):
+                pipeline.xdel(key, entry_id)
+            await pipeline.execute()
+        except Exception as e:
+            print(f"Failed to acknowledge {key} {entry_id}: {e}")
+
+    def _dispatch(self, key, entries):
+        for entry_id, fields in entries:
+            if fields is None:
+                # Trimmed from the stream before it was reclaimed
+                continue
+            self.inflight += 1
+            self.bus.loop.create_task(self._process(key, entry_id, fields))
+
+    async def _reclaim(self, keys):
+        """Take over entries another process read but never acknowledged."""
+        for key in keys:
+            response = await self.client.xautoclaim(
+                key, self.group, self.consumer, min_idle_time=self.claim_idle_ms, start_id="0-0", count=self.batch_size
+            )
+            self._dispatch(key, response[1])
+
+    async def _keep_leases(self):
+        """
+        Renew the leases three times per TTL, in its own task so they never expire while
+        the reader waits for slow handlers.
+        """
+        while True:
+            try:
+                if self.events & self.affinity_events:
+                    await self._refresh_leases()
+            except Exception as e:
+                print(f"Stream lease error: {e}")
+            await asyncio.sleep(self.lease_ttl_ms / 3000)
+
+    async def listen(self):
+        """Read the started streams until the process exits."""
+        self.client = aioredis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+        self.capacity = asyncio.Event()
+        self.bus.loop.create_task(self._keep_leases())
+        next_claim = 0
+
+        while True:
+            try:
+                now = time.monotonic()
+                keys = await self._streams()
+                if not keys:
+                    await asyncio.sleep(self.block_ms / 1000)
+                    continue
+
+                if now >= next_claim:
+                    await self._reclaim(keys)
+                    next_claim = now + self.claim_idle_ms / 2000
+
+                # Don't read more than the handlers can take
+                while self.inflight >= self.prefetch:
+                    self.capacity.clear()
+                    await self.capacity.wait()
+
+                response = await self.client.xreadgroup(
+                    self.group, self.consumer, {key: ">" for key in keys},
+                    count=min(self.batch_size, self.prefetch - self.inflight), block=self.block_ms,
+                )
+                for key, entries in response or ():
+                    self._dispatch(key.decode(), entries)
+            except Exception as e:
+                print(f"Stream listener error: {e}")
+                await asyncio.sleep(1)
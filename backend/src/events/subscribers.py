@@ -1,26 +1,78 @@
+from django.conf import settings
+
 from events.handlers import *
 from events.event_bus import event_bus
+from events.mailbox import audio_mailbox, response_mailbox, video_frame_mailbox
+from events.persistence import event_writer
+from events.services import audio_segmenter, warm_up
+from events.workers import vision_pool
+
+
+ROLES = ("web", "vision", "speech", "persistence")
 
 
-def initialize_listeners():
+def initialize_listeners(roles=None):
     """
-    Subscribes event handlers to the event bus.
+    Subscribes the event handlers of the given process roles to the event bus.
+
+    Roles:
+        - web: serves the WebSocket connections, which only publish events and
+          receive their session's events through the channel layer.
+        - vision: video frames, emotion and face recognition.
+        - speech: audio transcription and response generation.
+        - persistence: writes the event log.
     """
+    roles = [role for role in (settings.EVENTS_ROLES if roles is None else roles) if role != "none"]
+    for role in roles:
+        if role not in ROLES:
+            raise ValueError(f"Unknown process role {role}")
+
+    if settings.EVENTS_WARM_UP:
+        # Vision handlers run in the pool workers, which load their own models
+        warm_up([role for role in roles if not (role == "vision" and vision_pool is not None)])
+
+    if "vision" in roles:
+        if vision_pool is not None:
+            vision_pool.start()
+
+        # Video frames go through a bounded mailbox so slow vision handlers drop frames instead of lagging
+        # Session state is dropped through the mailbox too, after the session's last frame
+        video_frame_mailbox.subscribe("video.frame", process_emotions)
+        video_frame_mailbox.subscribe("video.frame", face_recognition)
+        video_frame_mailbox.subscribe("session.closed", forget_faces)
+        video_frame_mailbox.subscribe("session.closed", forget_emotions)
+        video_frame_mailbox.start()
+
+        event_bus.subscribe("video.frame", video_frame_mailbox.put)
+        event_bus.subscribe("session.closed", video_frame_mailbox.close)
+
+        event_bus.start_listener("video.frame")
+
+    if "speech" in roles:
+        # Handled in order per session and concurrently across sessions
+        audio_mailbox.subscribe("audio.raw", process_raw_audio)
+        audio_mailbox.subscribe("audio.chunk", process_audio_chunk)
+        audio_mailbox.subscribe("session.closed", audio_segmenter.forget)
+        response_mailbox.subscribe("audio.transcription", generate_response)
+        response_mailbox.subscribe("session.closed", conversation_cache.forget)
+        audio_mailbox.start()
+        response_mailbox.start()
 
-    event_bus.subscribe("video.frame", process_emotions)
-    event_bus.subscribe("video.frame", face_recognition)
-    
-    event_bus.subscribe("audio.raw", process_raw_audio)
-    event_bus.subscribe("audio.transcription", generate_response)
-    
-    event_bus.subscribe("event.save", save_event)
+        event_bus.subscribe("audio.raw", audio_mailbox.put)
+        event_bus.subscribe("audio.chunk", audio_mailbox.put)
+        event_bus.subscribe("audio.transcription", response_mailbox.put)
+        event_bus.subscribe("session.closed", audio_mailbox.close)
+        event_bus.subscribe("session.closed", response_mailbox.close)
 
-    # Listeners
-    event_bus.start_listener("video.frame") 
+        event_bus.start_listener("audio.raw")
+        event_bus.start_listener("audio.chunk")
+        event_bus.start_listener("audio.transcription")
 
-    event_bus.start_listener("audio.raw")
-    event_bus.start_listener("audio.transcription") 
+    if "persistence" in roles:
+        event_writer.start()
+        event_bus.subscribe("event.save", save_event)
 
-    event_bus.start_listener("assistant.response")
+        event_bus.start_listener("event.save")
 
-    event_bus.start_listener("event.save")
+    if "vision" in roles or "speech" in roles:
+        event_bus.start_listener("session.closed")
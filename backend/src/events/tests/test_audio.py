@@ -0,0 +1,74 @@
+from django.test import SimpleTestCase
+
+from events.audio import AudioSegmenter, EnergyVAD
+
+import numpy as np
+
+
+SAMPLE_RATE = 16000
+
+
+def tone(seconds, amplitude=5000):
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * 220 * t)).astype("<i2").tobytes()
+
+
+def silence(seconds):
+    return bytes(int(SAMPLE_RATE * seconds) * 2)
+
+
+class EnergyVADTests(SimpleTestCase):
+    def test_speech_and_silence(self):
+        vad = EnergyVAD(min_rms=300)
+        self.assertFalse(vad.is_speech(silence(0.03), SAMPLE_RATE))
+        self.assertTrue(vad.is_speech(tone(0.03), SAMPLE_RATE))
+
+    def test_noise_floor_adapts(self):
+        vad = EnergyVAD(min_rms=10, ratio=3.0, adaptation=1.0)
+        noise = tone(0.03, amplitude=100)
+        vad.is_speech(silence(0.03), SAMPLE_RATE)
+        self.assertTrue(vad.is_speech(noise, SAMPLE_RATE))
+        # Once the floor sits at the noise level, the same noise no longer counts as speech
+        vad.noise_floor = 70.0
+        self.assertFalse(vad.is_speech(noise, SAMPLE_RATE))
+
+
+class AudioSegmenterTests(SimpleTestCase):
+    def setUp(self):
+        self.segmenter = AudioSegmenter(
+            sample_rate=SAMPLE_RATE, frame_ms=30, start_ms=90, end_ms=300, pre_roll_ms=90, max_seconds=5,
+        )
+
+    def test_utterance(self):
+        results = self.segmenter.feed("s", silence(0.5) + tone(1.0) + silence(0.5), SAMPLE_RATE)
+
+        self.assertEqual([kind for kind, _ in results], ["utterance"])
+        duration = len(results[0][1]) / 2 / SAMPLE_RATE
+        # The speech, the pre-roll before it was detected and the silence that ended it
+        self.assertGreaterEqual(duration, 1.0)
+        self.assertLess(duration, 1.0 + 0.09 + 0.3 + 0.06)
+
+    def test_utterance_across_chunks(self):
+        audio = silence(0.5) + tone(1.0) + silence(0.5)
+        results = []
+        for offset in range(0, len(audio), 1000):
+            results += self.segmenter.feed("s", audio[offset:offset + 1000], SAMPLE_RATE)
+        self.assertEqual([kind for kind, _ in results], ["utterance"])
+
+    def test_silence_has_no_utterance(self):
+        self.assertEqual(self.segmenter.feed("s", silence(2), SAMPLE_RATE), [])
+
+    def test_max_length(self):
+        results = self.segmenter.feed("s", tone(11), SAMPLE_RATE)
+        self.assertEqual([kind for kind, _ in results], ["utterance", "utterance"])
+        self.assertEqual(len(results[0][1]), self.segmenter.max_frames * self.segmenter.frame_bytes)
+
+    def test_downmixes_stereo(self):
+        stereo = np.repeat(np.frombuffer(silence(0.5) + tone(1.0) + silence(0.5), dtype="<i2"), 2).tobytes()
+        results = self.segmenter.feed("s", stereo, SAMPLE_RATE, channels=2)
+        self.assertEqual([kind for kind, _ in results], ["utterance"])
+
+    def test_forget(self):
+        self.segmenter.feed("s", silence(0.5) + tone(1.0), SAMPLE_RATE)
+        self.segmenter.forget({"metadata": {"session_id": "s"}})
+        self.assertEqual(self.segmenter.feed("s", silence(0.5), SAMPLE_RATE), [])
@@ -0,0 +1,41 @@
+from django.test import SimpleTestCase
+
+from events.codecs import CODECS, CodecRegistry
+
+import json
+
+
+class CodecRegistryTests(SimpleTestCase):
+    event = {"type": "face.emotion", "payload": {"happy": 0.5, "faces": [1, 2]}, "metadata": {"session_id": "abc"}}
+
+    def test_round_trip(self):
+        for name in CODECS:
+            with self.subTest(codec=name):
+                codecs = CodecRegistry(name)
+                message = codecs.encode(self.event)
+                self.assertEqual(message[0], CODECS[name].id)
+                self.assertEqual(codecs.decode(message), self.event)
+
+    def test_msgpack_carries_bytes(self):
+        codecs = CodecRegistry("msgpack")
+        self.assertTrue(codecs.supports_bytes)
+        event = {"type": "video.frame", "payload": {"data": b"\xff\xd8\x00"}}
+        self.assertEqual(codecs.decode(codecs.encode(event)), event)
+
+    def test_decodes_messages_of_other_codecs(self):
+        message = CodecRegistry("msgpack").encode(self.event)
+        self.assertEqual(CodecRegistry("json").decode(message), self.event)
+
+    def test_decodes_json_without_header(self):
+        self.assertEqual(CodecRegistry("msgpack").decode(json.dumps(self.event).encode()), self.event)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            CodecRegistry("pickle")
+
+    def test_decode_errors(self):
+        codecs = CodecRegistry("json")
+        for message in (b"", None, b"\x09payload", b"\x01{not json"):
+            with self.subTest(message=message):
+                with self.assertRaises(ValueError):
+                    codecs.decode(message)
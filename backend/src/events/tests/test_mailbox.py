@@ -0,0 +1,81 @@
+from django.test import SimpleTestCase
+
+from events.mailbox import SessionMailbox
+from events.streams import ACK_KEY
+
+import threading
+
+
+def event(n, session="s", type="video.frame"):
+    return {"type": type, "payload": {"n": n}, "metadata": {"session_id": session}}
+
+
+def queued(mailbox, session="s"):
+    return [params["payload"]["n"] for params, ack in mailbox.queues.get(session, ())]
+
+
+class Acknowledgement:
+    def __init__(self):
+        self.count = 0
+
+    def done(self):
+        self.count += 1
+
+
+class SessionMailboxTests(SimpleTestCase):
+    def test_latest_keeps_the_newest_events(self):
+        mailbox = SessionMailbox("test", size=2)
+        for n in range(5):
+            mailbox.put(event(n))
+
+        self.assertEqual(queued(mailbox), [3, 4])
+        self.assertEqual(mailbox.stats()["dropped"], 3)
+        self.assertEqual(mailbox.stats()["depth"], 2)
+
+    def test_sessions_have_their_own_capacity(self):
+        mailbox = SessionMailbox("test", size=1)
+        mailbox.put(event(1, session="a"))
+        mailbox.put(event(2, session="b"))
+
+        self.assertEqual(queued(mailbox, "a"), [1])
+        self.assertEqual(queued(mailbox, "b"), [2])
+        self.assertEqual(mailbox.stats()["dropped"], 0)
+
+    def test_sample_accepts_every_nth_event(self):
+        mailbox = SessionMailbox("test", size=10, policy="sample", sample_every=3)
+        for n in range(7):
+            mailbox.put(event(n))
+
+        self.assertEqual(queued(mailbox), [0, 3, 6])
+        self.assertEqual(mailbox.stats()["sampled_out"], 4)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            SessionMailbox("test", policy="oldest")
+
+    def test_dropped_events_are_acknowledged(self):
+        mailbox = SessionMailbox("test", size=1, policy="sample", sample_every=2)
+        ack = Acknowledgement()
+        for n in range(4):
+            mailbox.put({**event(n), ACK_KEY: ack})
+
+        # 1 and 3 sampled out, 0 dropped for 2, 2 still queued
+        self.assertEqual(ack.count, 3)
+        self.assertNotIn(ACK_KEY, mailbox.queues["s"][0][0])
+
+    def test_handlers_run_in_order_and_close_runs_last(self):
+        mailbox = SessionMailbox("test", size=10)
+        handled = []
+        closed = threading.Event()
+        mailbox.subscribe("video.frame", lambda params: handled.append(params["payload"]["n"]))
+        mailbox.subscribe("session.closed", lambda params: (handled.append("closed"), closed.set()))
+
+        for n in range(3):
+            mailbox.put(event(n))
+        mailbox.close(event(None, type="session.closed"))
+        mailbox.put(event(3))
+        mailbox.start()
+
+        self.assertTrue(closed.wait(timeout=5))
+        self.assertEqual(handled, [0, 1, 2, "closed"])
+        self.assertEqual(mailbox.stats()["dropped"], 1)
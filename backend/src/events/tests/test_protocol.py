@@ -0,0 +1,47 @@
+from django.test import SimpleTestCase
+
+from virtual_humans.protocol import (
+    HEADER, KIND_AUDIO_CHUNK, KIND_VIDEO_FRAME, VERSION, ProtocolError, pack_message, unpack_message,
+)
+
+import uuid
+
+
+class ProtocolTests(SimpleTestCase):
+    def test_round_trip(self):
+        session_id = uuid.uuid4().hex
+        message = pack_message(
+            KIND_AUDIO_CHUNK, b"\x01\x02" * 160, session_id=session_id, sample_rate=16000, sample_width=2, channels=1,
+        )
+
+        type, header, body = unpack_message(message)
+        self.assertEqual(type, "audio.chunk")
+        self.assertEqual(header, {"session_id": session_id, "sample_rate": 16000, "sample_width": 2, "channels": 1})
+        self.assertEqual(bytes(body), b"\x01\x02" * 160)
+
+    def test_without_session(self):
+        type, header, body = unpack_message(pack_message(KIND_VIDEO_FRAME, b"jpeg"))
+        self.assertEqual(type, "video.frame")
+        self.assertIsNone(header["session_id"])
+        self.assertEqual(bytes(body), b"jpeg")
+
+    def test_short_message(self):
+        with self.assertRaises(ProtocolError):
+            unpack_message(b"\x01\x01")
+
+    def test_unsupported_version(self):
+        message = HEADER.pack(VERSION + 1, KIND_VIDEO_FRAME, bytes(16), 0, 0, 0, 4) + b"jpeg"
+        with self.assertRaises(ProtocolError):
+            unpack_message(message)
+
+    def test_unknown_kind(self):
+        message = HEADER.pack(VERSION, 99, bytes(16), 0, 0, 0, 4) + b"jpeg"
+        with self.assertRaises(ProtocolError):
+            unpack_message(message)
+
+    def test_payload_size_mismatch(self):
+        with self.assertRaises(ProtocolError):
+            unpack_message(pack_message(KIND_VIDEO_FRAME, b"jpeg") + b"extra")
+
+    def test_errors_are_value_errors(self):
+        self.assertTrue(issubclass(ProtocolError, ValueError))
@@ -0,0 +1,42 @@
+from django.test import SimpleTestCase
+
+from events.smoothing import EmotionSmoother, dominant
+
+
+class EmotionSmootherTests(SimpleTestCase):
+    def setUp(self):
+        self.smoother = EmotionSmoother(alpha=0.5, threshold=0.15, heartbeat=0)
+
+    def test_first_frame_is_published(self):
+        self.assertEqual(self.smoother.update("s", {"happy": 0.8, "sad": 0.2}), {"happy": 0.8, "sad": 0.2})
+
+    def test_moving_average(self):
+        self.smoother.update("s", {"happy": 0.8, "sad": 0.2})
+        self.assertEqual(self.smoother.update("s", {"happy": 0.2, "sad": 0.8}), {"happy": 0.5, "sad": 0.5})
+
+    def test_small_changes_are_suppressed(self):
+        self.smoother.update("s", {"happy": 0.8, "sad": 0.2})
+        self.assertIsNone(self.smoother.update("s", {"happy": 0.7, "sad": 0.3}))
+
+    def test_dominant_change_is_published(self):
+        smoother = EmotionSmoother(alpha=1, threshold=1, heartbeat=0)
+        smoother.update("s", {"happy": 0.55, "sad": 0.45})
+        self.assertEqual(smoother.update("s", {"happy": 0.45, "sad": 0.55}), {"happy": 0.45, "sad": 0.55})
+
+    def test_lost_face_is_published(self):
+        self.smoother.update("s", {"happy": 0.8, "sad": 0.2})
+        self.assertEqual(self.smoother.update("s", {}), {})
+        self.assertIsNone(self.smoother.update("s", {}))
+
+    def test_sessions_are_independent(self):
+        self.smoother.update("a", {"happy": 0.8, "sad": 0.2})
+        self.assertEqual(self.smoother.update("b", {"happy": 0.1, "sad": 0.9}), {"happy": 0.1, "sad": 0.9})
+
+    def test_forget(self):
+        self.smoother.update("s", {"happy": 0.8, "sad": 0.2})
+        self.smoother.forget({"metadata": {"session_id": "s"}})
+        self.assertEqual(self.smoother.update("s", {"happy": 0.2, "sad": 0.8}), {"happy": 0.2, "sad": 0.8})
+
+    def test_dominant(self):
+        self.assertEqual(dominant({"happy": 0.2, "angry": 0.7}), "angry")
+        self.assertIsNone(dominant({}))
@@ -0,0 +1,44 @@
+from django.test import RequestFactory, SimpleTestCase
+from django.utils import timezone
+
+from events.views import decode_cursor, encode_cursor, events_view
+
+from types import SimpleNamespace
+import base64
+import json
+
+
+class CursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        event = SimpleNamespace(timestamp=timezone.now(), id=42)
+        self.assertEqual(decode_cursor(encode_cursor(event)), (event.timestamp, 42))
+
+    def test_invalid_cursors(self):
+        cursors = (
+            "not base64!",
+            base64.urlsafe_b64encode(b"2024-01-01T00:00:00+00:00").decode(),
+            base64.urlsafe_b64encode(b"2024-01-01T00:00:00+00:00|x").decode(),
+            base64.urlsafe_b64encode(b"yesterday|42").decode(),
+            base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+        )
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(ValueError):
+                    decode_cursor(cursor)
+
+
+class EventsViewTests(SimpleTestCase):
+    def get(self, **params):
+        request = RequestFactory().get("/events", params)
+        request.user = SimpleNamespace(is_active=True, is_staff=True)
+        return events_view(request)
+
+    def test_invalid_cursor(self):
+        response = self.get(cursor="not base64!")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Invalid cursor", json.loads(response.content)["error"])
+
+    def test_invalid_parameters(self):
+        for params in ({"limit": "ten"}, {"since": "yesterday"}):
+            with self.subTest(params=params):
+                self.assertEqual(self.get(**params).status_code, 400)
@@ -0,0 +1,130 @@
+import itertools
+import time
+import cv2
+
+
+def iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes."""
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    intersection = max(0, right - left) * max(0, bottom - top)
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    union = area_a + area_b - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+class Track:
+    """
+    A face followed across frames.
+
+    Recognition stores its last result on the track (``recognized``, ``face`` and
+    ``recognized_at``), so it can be reused while the same face stays in view.
+    """
+
+    ids = itertools.count(1)
+
+    def __init__(self, box, template, previous=None):
+        self.id = previous.id if previous else next(self.ids)
+        self.box = box
+        self.template = template
+        self.recognized = previous.recognized if previous else False
+        self.face = previous.face if previous else None
+        self.recognized_at = previous.recognized_at if previous else None
+
+    def remember(self, recognized, face):
+        """Store the recognition result of the face on this track."""
+        self.recognized = recognized
+        self.face = face
+        self.recognized_at = time.monotonic()
+
+    def is_fresh(self, refresh_interval):
+        """Whether the stored recognition result can still be reused."""
+        return self.recognized_at is not None and time.monotonic() - self.recognized_at < refresh_interval
+
+
+class FaceTracker:
+    """
+    Follows the faces of one video session between keyframes.
+
+    On keyframes the caller runs full face detection and hands the boxes to ``reset``,
+    which associates them with existing tracks by IoU so they keep their id and
+    recognition result. In between, ``update`` follows every track by normalized
+    template matching of its keyframe patch in a window around its last position,
+    which costs a fraction of detection. A track is lost when the best match scores
+    below ``min_score``.
+    """
+
+    def __init__(self, keyframe_interval=10, min_score=0.5, search_margin=0.5, min_iou=0.3):
+        self.keyframe_interval = keyframe_interval
+        self.min_score = min_score
+        self.search_margin = search_margin
+        self.min_iou = min_iou
+        self.tracks = []
+        self.frames_since_keyframe = None
+
+    def keyframe_due(self):
+        """Whether the next frame needs full detection."""
+        return self.frames_since_keyframe is None or self.frames_since_keyframe + 1 >= self.keyframe_interval
+
+    def _follow(self, gray, track):
+        top, right, bottom, left = track.box
+        height, width = bottom - top, right - left
+        margin_y, margin_x = int(height * self.search_margin), int(width * self.search_margin)
+
+        window_top, window_left = max(0, top - margin_y), max(0, left - margin_x)
+        window = gray[window_top:min(gray.shape[0], bottom + margin_y), window_left:min(gray.shape[1], right + margin_x)]
+        if window.shape[0] < track.template.shape[0] or window.shape[1] < track.template.shape[1]:
+            return False
+
+        _, score, _, (x, y) = cv2.minMaxLoc(cv2.matchTemplate(window, track.template, cv2.TM_CCOEFF_NORMED))
+        if score < self.min_score:
+            return False
+
+        track.box = (window_top + y, window_left + x + width, window_top + y + height, window_left + x)
+        return True
+
+    def update(self, gray):
+        """
+        Follow every track into a new grayscale frame.
+
+        Returns:
+            bool: False when a track was lost and the frame needs full detection.
+        """
+        if not all(self._follow(gray, track) for track in self.tracks):
+            return False
+
+        self.frames_since_keyframe += 1
+        return True
+
+    def match(self, box, exclude=()):
+        """The existing track overlapping a detected box the most, if any overlaps enough."""
+        candidates = [track for track in self.tracks if track not in exclude]
+        best = max(candidates, key=lambda track: iou(track.box, box), default=None)
+        if best is not None and iou(best.box, box) >= self.min_iou:
+            return best
+        return None
+
+    def reset(self, gray, boxes):
+        """
+        Start tracking the faces detected on a keyframe.
+
+        Parameters:
+            gray (ndarray): The keyframe in grayscale.
+            boxes (list): The detected (top, right, bottom, left) face boxes.
+        """
+        tracks = []
+        matched = []
+        for box in boxes:
+            top, right, bottom, left = box
+            template = gray[max(0, top):bottom, max(0, left):right].copy()
+            if template.size == 0:
+                continue
+
+            previous = self.match(box, exclude=matched)
+            if previous is not None:
+                matched.append(previous)
+            tracks.append(Track(box, template, previous=previous))
+
+        self.tracks = tracks
+        self.frames_since_keyframe = 0
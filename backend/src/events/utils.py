@@ -1,15 +1,214 @@
+from django.conf import settings
+
+from events.event_bus import event_bus
+from events.metrics import stage_duration
+
+from collections import OrderedDict
 import numpy as np
+import threading
 import base64
 import cv2
 
 
+# JPEG decoding at 1/scale of the original resolution, done by the decoder itself
+DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def bytes_to_frame(frame_bytes, scale=1):
+    """
+    Decode raw JPEG (or any OpenCV supported image) bytes to a BGR frame,
+    optionally reduced to 1/2, 1/4 or 1/8 of the original size
+    """
+    if not isinstance(frame_bytes, np.ndarray):
+        frame_bytes = np.frombuffer(frame_bytes, dtype=np.uint8)
+    frame = cv2.imdecode(frame_bytes, DECODE_FLAGS[scale])
+    return frame
+
+
 def base64_to_frame(base64_string: str):
     """
     Convert base64-encoded string back to a frame
     """
-    frame_bytes = base64.b64decode(base64_string)
+    return bytes_to_frame(base64.b64decode(base64_string))
 
-    if not isinstance(frame_bytes, np.ndarray):
-        frame_bytes = np.frombuffer(frame_bytes, dtype=np.uint8)
-    frame = cv2.imdecode(frame_bytes, cv2.IMREAD_COLOR)
-    return frame
\ No newline at end of file
+
+def payload_bytes(payload: dict, field: str):
+    """
+    Get the raw bytes of an event payload.
+
+    Binary WebSocket messages carry the bytes themselves in ``field`` when the event bus
+    codec supports bytes, otherwise a ``blob`` reference to bytes stored next to the
+    event bus. JSON messages carry the bytes base64-encoded in ``field``.
+    """
+    if payload.get("blob"):
+        data = event_bus.get_blob(payload["blob"])
+        if data is None:
+            raise ValueError(f"Blob {payload['blob']} expired before it was processed")
+        return data
+
+    value = payload.get(field)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return value
+    return base64.b64decode(value)
+
+
+def payload_to_frame(payload: dict, scale=1):
+    """
+    Decode the frame of a video.frame payload
+    """
+    return bytes_to_frame(payload_bytes(payload, "data"), scale=scale)
+
+
+def pcm_to_mono16(audio_bytes, sample_width=2, channels=1):
+    """
+    Convert raw little-endian PCM audio to 16-bit mono
+    """
+    if sample_width == 2 and channels == 1:
+        return bytes(audio_bytes)
+
+    if sample_width == 1:
+        samples = (np.frombuffer(audio_bytes, dtype=np.uint8).astype(np.int16) - 128) << 8
+    elif sample_width == 2:
+        samples = np.frombuffer(audio_bytes, dtype="<i2")
+    elif sample_width == 4:
+        samples = (np.frombuffer(audio_bytes, dtype="<i4") >> 16).astype(np.int16)
+    else:
+        raise ValueError(f"Unsupported sample width {sample_width}")
+
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1).astype(np.int16)
+    return samples.astype("<i2").tobytes()
+
+
+def resample_pcm16(audio_bytes, from_rate, to_rate):
+    """
+    Resample 16-bit mono PCM audio by linear interpolation
+    """
+    if from_rate == to_rate or not audio_bytes:
+        return bytes(audio_bytes)
+
+    samples = np.frombuffer(audio_bytes, dtype="<i2").astype(np.float32)
+    length = int(round(len(samples) * to_rate / from_rate))
+    positions = np.arange(length, dtype=np.float32) * (from_rate / to_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype("<i2").tobytes()
+
+
+def frame_id(params: dict):
+    """
+    Identify the frame of a video.frame event, used as cache key.
+
+    The key is scoped to the session, so sessions never share decoded frames or the
+    faces detected in them, and identifies this event rather than its content: the
+    blob key of a binary message, otherwise the timestamp the server gave the event.
+    """
+    payload = params.get("payload") or {}
+    session_id = (params.get("metadata") or {}).get("session_id")
+    return (session_id, payload.get("blob") or params.get("timestamp"))
+
+
+class Frame:
+    """
+    A video frame decoded once and shared read-only between handlers.
+
+    Decoding happens on first access of ``bgr`` and the RGB and grayscale views are
+    converted lazily, so handlers only pay for the color spaces they use. The
+    arrays are marked read-only because they are shared across handler threads.
+    Other per-frame results, such as detected faces, can be shared with ``cached``.
+
+    With a ``scale`` above 1 the JPEG is decoded at reduced resolution; coordinates
+    in the frame are multiplied by ``scale`` to get original image coordinates.
+    """
+
+    def __init__(self, id, payload, scale=1):
+        self.id = id
+        self.payload = payload
+        self.scale = scale
+        self.lock = threading.RLock()
+        self.cache = {}
+
+    def cached(self, key, compute):
+        """Compute a value for this frame once, concurrent callers wait for the first."""
+        with self.lock:
+            if key not in self.cache:
+                self.cache[key] = compute()
+            return self.cache[key]
+
+    def _convert(self, key, convert):
+        def compute():
+            array = convert()
+            if array is None:
+                raise ValueError(f"Could not decode frame {self.id}")
+            array.flags.writeable = False
+            return array
+        return self.cached(key, compute)
+
+    @property
+    def bgr(self):
+        def decode():
+            with stage_duration.time(stage="decode"):
+                return payload_to_frame(self.payload, scale=self.scale)
+
+        return self._convert("bgr", decode)
+
+    @property
+    def rgb(self):
+        return self._convert("rgb", lambda: cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB))
+
+    @property
+    def gray(self):
+        return self._convert("gray", lambda: cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY))
+
+    def resized(self, color, max_width):
+        """
+        A view of the frame ("bgr", "rgb" or "gray") no wider than ``max_width``.
+
+        Returns:
+            tuple: (image, factor), multiply coordinates in the image by ``factor`` to get
+            frame coordinates.
+        """
+        image = getattr(self, color)
+        width = image.shape[1]
+        if not max_width or width <= max_width:
+            return image, 1.0
+
+        factor = width / max_width
+        size = (max_width, round(image.shape[0] / factor))
+        return self._convert(f"{color}@{max_width}", lambda: cv2.resize(image, size, interpolation=cv2.INTER_AREA)), factor
+
+
+class FrameCache:
+    """
+    Small thread-safe LRU cache of ``Frame`` objects keyed by ``frame_id``.
+
+    Handlers subscribed to the same video.frame event get the same ``Frame`` back,
+    so the frame is decoded by whichever handler gets to it first.
+    """
+
+    def __init__(self, max_size, scale=1):
+        if scale not in DECODE_FLAGS:
+            raise ValueError(f"Unsupported frame decode scale {scale}, use one of {', '.join(map(str, DECODE_FLAGS))}")
+        self.max_size = max_size
+        self.scale = scale
+        self.frames = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, params: dict):
+        """The frame of a video.frame event."""
+        key = frame_id(params)
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is None:
+                frame = self.frames[key] = Frame(key, params.get("payload"), scale=self.scale)
+                while len(self.frames) > self.max_size:
+                    self.frames.popitem(last=False)
+            else:
+                self.frames.move_to_end(key)
+            return frame
+
+
+frame_cache = FrameCache(max_size=settings.FRAME_CACHE_SIZE, scale=settings.FRAME_DECODE_SCALE)
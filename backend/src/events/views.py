@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse, JsonResponse
+from django.utils.dateparse import parse_datetime
+
+from events.metrics import CONTENT_TYPE, metrics
+from events.models import Event
+
+import base64
+
+
+def metrics_view(request):
+    """Expose the metrics of this process in the Prometheus text format."""
+    return HttpResponse(metrics.render(), content_type=CONTENT_TYPE)
+
+
+def encode_cursor(event):
+    return base64.urlsafe_b64encode(f"{event.timestamp.isoformat()}|{event.id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """The (timestamp, id) of a cursor returned by ``encode_cursor``."""
+    try:
+        timestamp, _, id = base64.urlsafe_b64decode(cursor.encode()).decode().partition("|")
+        timestamp, id = parse_datetime(timestamp), int(id)
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor {cursor}")
+    if timestamp is None:
+        raise ValueError(f"Invalid cursor {cursor}")
+    return timestamp, id
+
+
+def _datetime(request, name):
+    value = request.GET.get(name)
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"Invalid {name} {value}")
+    return parsed
+
+
+@staff_member_required
+def events_view(request):
+    """
+    Page through the event log in time order.
+
+    Query parameters: ``session_id``, ``type`` (can be repeated), ``since`` and ``until``
+    (ISO 8601), ``limit`` and ``cursor``. Pages are read with a keyset cursor instead of
+    an offset, so every page costs the same however deep it is: pass the ``next`` cursor
+    of a response to get the following page, it is null on the last page. Blob fields are
+    returned as references, see ``Event.resolved_data``.
+    """
+    try:
+        limit = int(request.GET.get("limit", settings.EVENT_API_PAGE_SIZE))
+        limit = max(1, min(limit, settings.EVENT_API_MAX_PAGE_SIZE))
+        events = Event.objects.history(
+            session_id=request.GET.get("session_id"),
+            event_types=request.GET.getlist("type"),
+            since=_datetime(request, "since"),
+            until=_datetime(request, "until"),
+        )
+        if request.GET.get("cursor"):
+            events = events.after(*decode_cursor(request.GET["cursor"]))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    # One extra row tells whether there is a next page
+    page = list(events[:limit + 1])
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+
+    return JsonResponse({
+        "events": [
+            {
+                "event_id": str(event.event_id),
+                "type": event.event_type,
+                "timestamp": event.timestamp.isoformat(),
+                "session_id": event.session_id,
+                "payload": event.data,
+                "metadata": event.metadata,
+            }
+            for event in page[:limit]
+        ],
+        "next": next_cursor,
+    })
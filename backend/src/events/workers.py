@@ -0,0 +1,122 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+
+from events.metrics import metrics
+
+import multiprocessing
+import threading
+import importlib
+import zlib
+import os
+
+
+# Set in worker processes, which must not start event bus listeners of their own
+WORKER_ENV = "EVENTS_PROCESS_WORKER"
+
+
+def process_pool_handler(handler):
+    """
+    Declare that a handler runs in the vision process pool.
+
+    The handler must be a module-level function, it is looked up by name in the worker.
+    """
+    handler.run_in_process = True
+    return handler
+
+
+def in_worker():
+    return bool(os.environ.get(WORKER_ENV))
+
+
+def _initialize_worker():
+    """Set up Django and load the vision models once per worker process."""
+    os.environ[WORKER_ENV] = "1"
+
+    import django
+    django.setup()
+
+    # Observations are sent back to the parent process, which serves the metrics
+    metrics.start_buffering()
+
+    # Load the vision models and the face index before the first frame arrives
+    from events.services import warm_up
+    warm_up(["vision"])
+
+
+def _run_in_worker(module, name, params):
+    handler = getattr(importlib.import_module(module), name)
+    handler(params)
+    return metrics.drain()
+
+
+class ProcessPool:
+    """
+    Pool of worker processes for CPU-bound handlers.
+
+    TensorFlow and dlib hold the GIL for most of a call, so vision handlers only scale
+    past one core when they run in separate processes. Each worker is a single-process
+    executor that loads the models once at start-up. Events are routed by session, so
+    a session's frames always reach the same worker and per-session state (face
+    trackers, decoded frames) stays in one place.
+
+    The event is pickled to the worker once per handler call. With a binary event bus
+    codec (msgpack by default) it carries the raw JPEG bytes, with other codecs a base64
+    string or the blob reference of a binary message, which the worker fetches from
+    Redis itself. Results are published by the worker.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.executors = [None] * workers
+        self.lock = threading.Lock()
+
+    def _executor(self, index):
+        with self.lock:
+            if self.executors[index] is None:
+                self.executors[index] = ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_initialize_worker,
+                )
+            return self.executors[index]
+
+    def run(self, handler, params):
+        """Run a handler in the worker of the event's session and wait for it."""
+        session = (params.get("metadata") or {}).get("session_id") or ""
+        index = zlib.crc32(session.encode()) % self.workers
+        executor = self._executor(index)
+
+        try:
+            observations = executor.submit(_run_in_worker, handler.__module__, handler.__name__, params).result()
+        except BrokenProcessPool:
+            # Replace the crashed worker, the event is lost
+            with self.lock:
+                if self.executors[index] is executor:
+                    self.executors[index] = None
+            raise
+
+        metrics.replay(observations)
+
+    def start(self):
+        """Start every worker now, so models are loaded before the first event arrives."""
+        for index in range(self.workers):
+            self._executor(index).submit(os.getpid)
+
+    def shutdown(self):
+        with self.lock:
+            for executor in self.executors:
+                if executor is not None:
+                    executor.shutdown(wait=False, cancel_futures=True)
+            self.executors = [None] * self.workers
+
+
+vision_pool = ProcessPool(workers=settings.VISION_PROCESS_WORKERS) if settings.VISION_PROCESS_WORKERS else None
+
+
+def run_handler(handler, params):
+    """Call a handler, in the process pool when it is declared to run there."""
+    if vision_pool is not None and getattr(handler, "run_in_process", False) and not in_worker():
+        vision_pool.run(handler, params)
+    else:
+        handler(params)
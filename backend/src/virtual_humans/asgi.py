@@ -15,4 +15,8 @@ application = ProtocolTypeRouter({
           routing.websocket_urlpatterns
       )
   )
-})
\ No newline at end of file
+})
+
+# Start the event handlers of the roles of this process, see EVENTS_ROLES
+from events.subscribers import initialize_listeners
+initialize_listeners()
\ No newline at end of file
@@ -1,50 +1,176 @@
-from channels.generic.websocket import WebsocketConsumer
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
 from django.utils import timezone
 
 from events.event_bus import event_bus
+from events.metrics import metrics
+from .protocol import ProtocolError, unpack_message
+import asyncio
 import json
+import uuid
 
 
-class VirtualHumanConsumer(WebsocketConsumer):
-    def connect(self):
+# Metadata set by the server only, clients can't supply these
+RESERVED_METADATA = ("session_id", "replay", "origin_type", "origin_timestamp")
+# Payload fields set by the server only: "blob" names a Redis key handlers read, see receive_binary
+RESERVED_PAYLOAD = ("blob",)
+
+outbox_dropped = metrics.counter("websocket_outbox_dropped_total", "Outgoing events dropped because a client fell behind")
+
+
+class VirtualHumanConsumer(AsyncWebsocketConsumer):
+    """
+    WebSocket connection of a Virtual Human.
+
+    Runs entirely on the server's event loop: incoming events are published with the
+    event bus' non-blocking ``apublish``, and outgoing events go through a bounded
+    outbox drained by a sender task, so a slow client never holds up the loop. Events
+    of the session arrive on the loop through its Channels group (``virtual_human_event``)
+    and are put in the outbox. When the outbox is full the oldest event is dropped.
+    """
+
+    async def connect(self):
         """ Handles WebSocket connection """
-        event_bus.subscribe("assistant.response", self.virtual_human_event_handler)
+        self.session_id = uuid.uuid4().hex
+        self.outbox = asyncio.Queue(maxsize=settings.WEBSOCKET_OUTBOX_SIZE)
+        self.dropped = 0
+
+        # Events of this session are delivered to its group, see ``EventBus.session_group``
+        self.group_name = event_bus.session_group(self.session_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
 
-        self.accept()
+        await self.accept()
+        self.sender = asyncio.get_running_loop().create_task(self._send_outbox())
 
-        self.send(text_data=json.dumps({
+        self._enqueue({
             'type': 'connection_established',
             'message': 'success',
-        }))
+            'session_id': self.session_id,
+        })
+
+    async def disconnect(self, close_code):
+        """ Stop sending and leave the session group on disconnect """
+        if hasattr(self, "sender"):
+            self.sender.cancel()
+        if not hasattr(self, "group_name"):
+            # connect failed before the session was set up
+            return
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
-    def disconnect(self, close_code):
-        """ Unsubscribe on disconnect to avoid duplicated subscriptions """
-        if "assistant.response" in event_bus.subscribers:
-            event_bus.subscribers["assistant.response"].remove(self.virtual_human_event_handler)
+        # Let handlers drop per-session state
+        await event_bus.apublish("session.closed", {
+            "type": "session.closed",
+            "payload": {},
+            "timestamp": timezone.now().isoformat(),
+            "metadata": {"session_id": self.session_id},
+        })
 
-    def receive(self, text_data=None, bytes_data=None) -> None:
+    async def receive(self, text_data=None, bytes_data=None) -> None:
         """
         Called when data is received from a client
         """
+        if bytes_data:
+            await self.receive_binary(bytes_data)
+            return
+
         if not text_data:
             return
 
         data = json.loads(text_data)
         type = data.get("type")
 
+        metadata = data.get("metadata")
+        if not isinstance(metadata, dict):
+            metadata = {}
+
+        payload = data.get("payload")
+        if isinstance(payload, dict):
+            data["payload"] = {key: value for key, value in payload.items() if key not in RESERVED_PAYLOAD}
+
         # Build event payload
+        timestamp = timezone.now().isoformat()
         message = {
             **data,
-            "timestamp": timezone.now().isoformat(),
+            "timestamp": timestamp,
+            "metadata": {
+                **{key: value for key, value in metadata.items() if key not in RESERVED_METADATA},
+                "session_id": self.session_id,
+                "origin_type": type,
+                "origin_timestamp": timestamp,
+            },
         }
 
-        event_bus.publish(type, message)
+        await event_bus.apublish(type, message)
+
+    async def receive_binary(self, bytes_data):
+        """
+        Publish a framed binary message (see ``virtual_humans.protocol``).
+
+        Messages can only be sent for the session of this connection: a header naming
+        another session is dropped.
+
+        With a binary event bus codec the raw JPEG or PCM body is carried in the event
+        itself, otherwise it is stored next to the event bus and the event only carries a
+        reference to it. Either way no base64 encoding happens on either side.
+        """
+        try:
+            type, header, body = unpack_message(bytes_data)
+        except ProtocolError as e:
+            print(f"Dropped binary message: {e}")
+            return
+        if header["session_id"] and header["session_id"] != self.session_id:
+            print(f"Dropped binary message of session {self.session_id} for session {header['session_id']}")
+            return
+
+        if event_bus.codecs.supports_bytes:
+            payload = {"data" if type == "video.frame" else "bytes": bytes(body)}
+        else:
+            payload = {"blob": await event_bus.aput_blob(body)}
+        payload["size"] = len(body)
+        if type in ("audio.raw", "audio.chunk"):
+            payload.update({
+                "sample_rate": header["sample_rate"],
+                "sample_width": header["sample_width"],
+                "channels": header["channels"],
+            })
+
+        timestamp = timezone.now().isoformat()
+        message = {
+            "type": type,
+            "payload": payload,
+            "timestamp": timestamp,
+            "metadata": {
+                "session_id": self.session_id,
+                "origin_type": type,
+                "origin_timestamp": timestamp,
+            },
+        }
+
+        await event_bus.apublish(type, message)
+
+    def _enqueue(self, data):
+        """Put an outgoing event in the outbox, dropping the oldest one when it is full."""
+        if self.outbox.full():
+            self.outbox.get_nowait()
+            self.dropped += 1
+            outbox_dropped.inc()
+            print(f"Outbox of session {self.session_id} is full, dropped {self.dropped} events")
+        self.outbox.put_nowait(data)
+
+    async def _send_outbox(self):
+        while True:
+            data = await self.outbox.get()
+            try:
+                await self.send(text_data=json.dumps(data))
+            except Exception as e:
+                print(f"Failed to send to session {self.session_id}: {e}")
 
-    def virtual_human_event_handler(self, data):
-        """ Send actionable behaviour and responses to Virtual Human """
-        self.send(text_data=json.dumps({
+    async def virtual_human_event(self, event):
+        """ Send actionable behaviour and responses of this session to Virtual Human """
+        data = event["event"]
+        self._enqueue({
             "type": data.get("type"),
             "payload": data.get("payload"),
             "timestamp": data.get("timestamp"),
             "metadata": data.get("metadata") or {}
-        }))
\ No newline at end of file
+        })
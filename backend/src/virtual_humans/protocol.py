@@ -0,0 +1,60 @@
+import struct
+import uuid
+
+
+# Binary WebSocket frame header, network byte order:
+#   version (B), kind (B), session (16s, UUID bytes or zeros), sample_rate (I),
+#   sample_width (B), channels (B), payload_size (I)
+HEADER = struct.Struct("!BB16sIBBI")
+VERSION = 1
+
+KIND_VIDEO_FRAME = 1
+KIND_AUDIO_RAW = 2
+KIND_AUDIO_CHUNK = 3
+
+EVENT_TYPES = {
+    KIND_VIDEO_FRAME: "video.frame",
+    KIND_AUDIO_RAW: "audio.raw",
+    KIND_AUDIO_CHUNK: "audio.chunk",
+}
+
+
+class ProtocolError(ValueError):
+    """Raised when a binary WebSocket message can't be parsed."""
+
+
+def pack_message(kind, body, session_id=None, sample_rate=0, sample_width=0, channels=0):
+    """
+    Build a binary message, the inverse of ``unpack_message``. Used by clients and tools.
+    """
+    session = uuid.UUID(session_id).bytes if session_id else bytes(16)
+    return HEADER.pack(VERSION, kind, session, sample_rate, sample_width, channels, len(body)) + body
+
+
+def unpack_message(data: bytes):
+    """
+    Split a binary WebSocket message into its header fields and raw body.
+
+    Returns:
+        tuple: (event type, header dict, memoryview of the JPEG or PCM body)
+    """
+    if len(data) < HEADER.size:
+        raise ProtocolError(f"Message shorter than header ({len(data)} < {HEADER.size} bytes)")
+
+    version, kind, session, sample_rate, sample_width, channels, payload_size = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    if kind not in EVENT_TYPES:
+        raise ProtocolError(f"Unknown message kind {kind}")
+
+    body = memoryview(data)[HEADER.size:]
+    if len(body) != payload_size:
+        raise ProtocolError(f"Payload size mismatch ({len(body)} != {payload_size} bytes)")
+
+    header = {
+        "session_id": uuid.UUID(bytes=session).hex if any(session) else None,
+        "sample_rate": sample_rate,
+        "sample_width": sample_width,
+        "channels": channels,
+    }
+    return EVENT_TYPES[kind], header, body
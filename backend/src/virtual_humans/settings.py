@@ -124,7 +124,173 @@ AUTH_USER_MODEL = "users.User"
 
 DATA_UPLOAD_MAX_NUMBER_FIELDS = None
 
-REDIS_HOST = "redis"
-REDIS_PORT = 6379
+REDIS_HOST = env.str("REDIS_HOST", default="redis")
+REDIS_PORT = env.int("REDIS_PORT", default=6379)
+
+# Events sent to the WebSocket of the session in their metadata, through a Channels group per session
+CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "CONFIG": {
+            "hosts": [(REDIS_HOST, REDIS_PORT)],
+            "capacity": env.int("CHANNEL_LAYER_CAPACITY", default=500),
+            "expiry": env.int("CHANNEL_LAYER_EXPIRY", default=30),
+        },
+    },
+}
+# Outgoing events buffered per WebSocket connection, the oldest are dropped when a client falls behind
+WEBSOCKET_OUTBOX_SIZE = env.int("WEBSOCKET_OUTBOX_SIZE", default=256)
+SESSION_ROUTED_EVENTS = env.list("SESSION_ROUTED_EVENTS", default=["assistant.response", "assistant.response.delta"])
+# Event types reported by name in metrics, other types sent by clients are counted as "other"
+EVENT_TYPES = [
+    "audio.raw", "audio.chunk", "audio.transcription", "audio.transcription.partial", "video.frame",
+    "face.detected", "face.emotion", "assistant.response", "assistant.response.delta", "session.closed", "event.save",
+]
 
-OPENAI_API_KEY = env.str("OPENAI_API_KEY")
\ No newline at end of file
+# Process roles: "web", "vision", "speech", "persistence" or "none", decide which event handlers
+# the ASGI application starts. Dedicated workers run "manage.py run_worker --role <role>".
+EVENTS_ROLES = env.list("EVENTS_ROLES", default=["web", "vision", "speech", "persistence"])
+# Load the models of the roles at start-up instead of on the first event
+EVENTS_WARM_UP = env.bool("EVENTS_WARM_UP", default=True)
+# Port of the metrics endpoint of "manage.py run_worker" processes, 0 disables it
+WORKER_METRICS_PORT = env.int("WORKER_METRICS_PORT", default=9100)
+
+# Event bus
+# "asyncio" multiplexes every channel over one pub/sub connection, "threaded" opens one per channel,
+# "streams" queues events in Redis Streams so each event is handled by one process only
+EVENT_BUS_MODE = env.str("EVENT_BUS_MODE", default="asyncio")
+EVENT_BUS_WORKERS = env.int("EVENT_BUS_WORKERS", default=8)
+EVENT_BUS_HANDLER_CONCURRENCY = env.int("EVENT_BUS_HANDLER_CONCURRENCY", default=1)
+# Asyncio mode: events waiting per (channel, handler). When a queue is full "drop" drops the oldest
+# event, "block" stops reading until there is room and leaves the backlog to Redis
+EVENT_BUS_HANDLER_QUEUE_SIZE = env.int("EVENT_BUS_HANDLER_QUEUE_SIZE", default=100)
+EVENT_BUS_QUEUE_POLICY = env.str("EVENT_BUS_QUEUE_POLICY", default="drop")
+# Message codec: "json", "orjson" or "msgpack" (carries binary payloads without base64)
+EVENT_BUS_CODEC = env.str("EVENT_BUS_CODEC", default="msgpack")
+# Streams mode: events with per-session handler state go to the same process for a session
+EVENT_BUS_STREAM_GROUP = env.str("EVENT_BUS_STREAM_GROUP", default="handlers")
+EVENT_BUS_STREAM_MAXLEN = env.int("EVENT_BUS_STREAM_MAXLEN", default=10000)
+EVENT_BUS_STREAM_BATCH_SIZE = env.int("EVENT_BUS_STREAM_BATCH_SIZE", default=32)
+EVENT_BUS_STREAM_PREFETCH = env.int("EVENT_BUS_STREAM_PREFETCH", default=64)
+EVENT_BUS_STREAM_CLAIM_IDLE_MS = env.int("EVENT_BUS_STREAM_CLAIM_IDLE_MS", default=60000)
+EVENT_BUS_STREAM_PARTITIONS = env.int("EVENT_BUS_STREAM_PARTITIONS", default=16)
+EVENT_BUS_AFFINITY_EVENTS = env.list("EVENT_BUS_AFFINITY_EVENTS", default=["video.frame", "audio.chunk"])
+# Event types queued in streams, the ones with a stream consumer. "maxlen" caps the entries kept per
+# stream (default EVENT_BUS_STREAM_MAXLEN), "max_age" keeps the last N seconds instead and "delete"
+# deletes entries once handled. Other types, like session.closed, reach every process over pub/sub
+EVENT_BUS_STREAM_POLICIES = {
+    "video.frame": {"maxlen": env.int("EVENT_BUS_STREAM_VIDEO_FRAME_MAXLEN", default=500), "delete": True},
+    "audio.raw": {"maxlen": 1000, "delete": True},
+    "audio.chunk": {"max_age": env.int("EVENT_BUS_STREAM_AUDIO_CHUNK_MAX_AGE", default=300), "delete": True},
+    "audio.transcription": {},
+    "event.save": {},
+}
+# Seconds binary payloads received over the WebSocket are kept in Redis for handlers
+EVENT_BUS_BLOB_TTL = env.int("EVENT_BUS_BLOB_TTL", default=60)
+
+# Number of decoded video frames kept for the handlers sharing them
+FRAME_CACHE_SIZE = env.int("FRAME_CACHE_SIZE", default=8)
+# Decode JPEG frames at 1/N resolution (1, 2, 4 or 8)
+FRAME_DECODE_SCALE = env.int("FRAME_DECODE_SCALE", default=1)
+
+# Worker processes for vision handlers, 0 runs them in the API process
+VISION_PROCESS_WORKERS = env.int("VISION_PROCESS_WORKERS", default=0)
+
+# Video frame backpressure: "latest" keeps the newest frames, "sample" only accepts every Nth frame
+VIDEO_FRAME_POLICY = env.str("VIDEO_FRAME_POLICY", default="latest")
+VIDEO_FRAME_MAILBOX_SIZE = env.int("VIDEO_FRAME_MAILBOX_SIZE", default=1)
+VIDEO_FRAME_SAMPLE_EVERY = env.int("VIDEO_FRAME_SAMPLE_EVERY", default=3)
+VIDEO_FRAME_WORKERS = env.int("VIDEO_FRAME_WORKERS", default=max(2, VISION_PROCESS_WORKERS))
+
+# face.emotion smoothing, ALPHA is the weight of the newest frame (1 disables smoothing). Results are
+# published when the dominant emotion changes, a score moves by THRESHOLD or every HEARTBEAT seconds
+EMOTION_SMOOTHING_ALPHA = env.float("EMOTION_SMOOTHING_ALPHA", default=0.3)
+EMOTION_PUBLISH_THRESHOLD = env.float("EMOTION_PUBLISH_THRESHOLD", default=0.15)
+EMOTION_HEARTBEAT_INTERVAL = env.float("EMOTION_HEARTBEAT_INTERVAL", default=5.0)
+
+# Event log writer, flushes a batch once it is full or FLUSH_INTERVAL seconds old
+EVENT_WRITER_BATCH_SIZE = env.int("EVENT_WRITER_BATCH_SIZE", default=200)
+EVENT_WRITER_FLUSH_INTERVAL = env.float("EVENT_WRITER_FLUSH_INTERVAL", default=1.0)
+EVENT_WRITER_MAX_PENDING = env.int("EVENT_WRITER_MAX_PENDING", default=5000)
+EVENT_WRITER_PUT_TIMEOUT = env.float("EVENT_WRITER_PUT_TIMEOUT", default=5.0)
+
+# Event log storage per event type, large binary fields go to a blob store under MEDIA_ROOT
+EVENT_BLOB_MIN_SIZE = env.int("EVENT_BLOB_MIN_SIZE", default=1024)
+EVENT_STORAGE_POLICIES = {
+    "video.frame": {"blobs": ["data"], "sample_every": env.int("EVENT_STORE_VIDEO_FRAME_EVERY", default=30)},
+    "audio.raw": {"blobs": ["bytes"]},
+    "audio.chunk": {"skip": True},
+    "audio.transcription.partial": {"skip": True},
+    "assistant.response.delta": {"skip": True},
+}
+
+# Event log retention, applied by `manage.py prune_events`. Per event type, events are deleted
+# after max_age_days and thinned out to every keep_every-th event after downsample_after_days
+EVENT_RETENTION_DAYS = env.int("EVENT_RETENTION_DAYS", default=90) # 0 keeps events forever
+EVENT_RETENTION_POLICIES = {
+    "video.frame": {"max_age_days": 7},
+    "audio.raw": {"max_age_days": 30},
+    "face.detected": {"downsample_after_days": 1, "keep_every": 10},
+    "face.emotion": {"downsample_after_days": 1, "keep_every": 10},
+}
+EVENT_API_PAGE_SIZE = env.int("EVENT_API_PAGE_SIZE", default=100)
+EVENT_API_MAX_PAGE_SIZE = env.int("EVENT_API_MAX_PAGE_SIZE", default=1000)
+
+# Face recognition, enrolled encodings are snapshotted to FACE_INDEX_SNAPSHOT and memory-mapped on start
+FACE_RECOGNITION_TOLERANCE = env.float("FACE_RECOGNITION_TOLERANCE", default=0.5)
+FACE_INDEX_SNAPSHOT = env.str("FACE_INDEX_SNAPSHOT", default=str(Path(MEDIA_ROOT) / "face_index.npy"))
+FACE_INDEX_AUTO_ENROLL = env.bool("FACE_INDEX_AUTO_ENROLL", default=True)
+# Seconds between loading faces enrolled by other processes, 0 disables it
+FACE_INDEX_REFRESH_INTERVAL = env.float("FACE_INDEX_REFRESH_INTERVAL", default=10.0)
+
+# Face detection shared by emotion and face recognition: "hog", "cnn", "mtcnn" or "haar"
+FACE_DETECTION_MODEL = env.str("FACE_DETECTION_MODEL", default="hog")
+FACE_DETECTION_UPSAMPLE = env.int("FACE_DETECTION_UPSAMPLE", default=1)
+# Frames wider than this are downscaled before detection, 0 disables downscaling
+FACE_DETECTION_MAX_WIDTH = env.int("FACE_DETECTION_MAX_WIDTH", default=640)
+
+# Face tracking, faces are detected every KEYFRAME_INTERVAL frames and re-encoded after REFRESH_INTERVAL seconds
+FACE_TRACKING = env.bool("FACE_TRACKING", default=True)
+FACE_TRACKING_KEYFRAME_INTERVAL = env.int("FACE_TRACKING_KEYFRAME_INTERVAL", default=10)
+FACE_TRACKING_REFRESH_INTERVAL = env.float("FACE_TRACKING_REFRESH_INTERVAL", default=5.0)
+FACE_TRACKING_MIN_SCORE = env.float("FACE_TRACKING_MIN_SCORE", default=0.5)
+
+OPENAI_API_KEY = env.str("OPENAI_API_KEY")
+
+# LLM, LLM_BASE_URL points the client at any OpenAI-compatible endpoint (e.g. the stub_llm command)
+LLM_MODEL = env.str("LLM_MODEL", default="gpt-3.5-turbo")
+LLM_BASE_URL = env.str("LLM_BASE_URL", default=None)
+# Publish assistant.response.delta events while the response is generated
+LLM_STREAMING = env.bool("LLM_STREAMING", default=True)
+# Conversation context per session, trimmed to a token budget and optionally summarized
+LLM_CONTEXT_TOKENS = env.int("LLM_CONTEXT_TOKENS", default=3000)
+LLM_CONTEXT_SUMMARIZE = env.bool("LLM_CONTEXT_SUMMARIZE", default=False)
+CONVERSATION_CACHE_SIZE = env.int("CONVERSATION_CACHE_SIZE", default=1000)
+
+# Speech-to-text backend: "google" (Google Web Speech API), "vosk" (local, offline) or "stub" (benchmarks)
+SPEECH_BACKEND = env.str("SPEECH_BACKEND", default="google")
+SPEECH_LANGUAGE = env.str("SPEECH_LANGUAGE", default="nl-NL")
+VOSK_MODEL_PATH = env.str("VOSK_MODEL_PATH", default=str(BASE_DIR / "models" / "vosk-model-small-nl-0.22"))
+SPEECH_BACKEND_OPTIONS = {
+    "vosk": {"model_path": VOSK_MODEL_PATH},
+    "stub": {"delay": env.float("SPEECH_STUB_DELAY", default=0.3)},
+}.get(SPEECH_BACKEND, {})
+
+# Streamed audio.chunk events are resampled to AUDIO_SAMPLE_RATE and cut into utterances by
+# voice activity detection: "energy" or "webrtc" (requires webrtcvad)
+AUDIO_SAMPLE_RATE = env.int("AUDIO_SAMPLE_RATE", default=16000)
+AUDIO_VAD = env.str("AUDIO_VAD", default="energy")
+AUDIO_VAD_OPTIONS = {
+    "energy": {"min_rms": env.float("AUDIO_VAD_MIN_RMS", default=300)},
+    "webrtc": {"aggressiveness": env.int("AUDIO_VAD_AGGRESSIVENESS", default=2)},
+}.get(AUDIO_VAD, {})
+AUDIO_VAD_START_MS = env.int("AUDIO_VAD_START_MS", default=90)
+AUDIO_VAD_END_MS = env.int("AUDIO_VAD_END_MS", default=600)
+AUDIO_PRE_ROLL_MS = env.int("AUDIO_PRE_ROLL_MS", default=300)
+AUDIO_MAX_UTTERANCE_SECONDS = env.float("AUDIO_MAX_UTTERANCE_SECONDS", default=15)
+
+# Speech handlers run on SPEECH_WORKERS threads, in order per session. A session holds at most
+# AUDIO_MAILBOX_SIZE audio events and RESPONSE_MAILBOX_SIZE transcriptions, the oldest are dropped
+SPEECH_WORKERS = env.int("SPEECH_WORKERS", default=4)
+AUDIO_MAILBOX_SIZE = env.int("AUDIO_MAILBOX_SIZE", default=500)
+RESPONSE_MAILBOX_SIZE = env.int("RESPONSE_MAILBOX_SIZE", default=10)
\ No newline at end of file